@@ -0,0 +1,127 @@
+from functools import wraps
+from hashlib import md5
+from time import time_ns
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+# Параметры списка рецептов, зависящие от счётчика избранного.
+POPULARITY_PARAMS = {'ordering', 'min_favorites'}
+
+
+def get_version(name, timeout=None):
+    """Текущая версия (поколение) набора данных name.
+
+    Версия - время последнего изменения в наносекундах. Пока её нет
+    в кэше, она создаётся заново, так что холодный кэш просто
+    сбрасывает все зависящие от неё ключи.
+    """
+    key = f'version:{name}'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time_ns(), timeout)
+        version = cache.get(key, time_ns())
+    return version
+
+
+def bump_version(name, timeout=None):
+    cache.set(f'version:{name}', time_ns(), timeout)
+
+
+def bump_version_on_commit(name, timeout=None):
+    """Сбрасывает версию после фиксации транзакции.
+
+    Иначе параллельный запрос успеет закэшировать данные без
+    изменений, ещё не видных ему, уже под новой версией.
+    """
+    transaction.on_commit(lambda: bump_version(name, timeout))
+
+
+def count(name):
+    key = f'stats:{name}'
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def cache_reference(name):
+    """Кэширует ответ GET-метода вьюсета до изменения справочника name.
+
+    Ответ хранится под ключом с версией справочника, на условные
+    запросы с If-None-Match и If-Modified-Since отдаётся 304.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            version = get_version(name, settings.REFERENCE_CACHE_TIMEOUT)
+            key = f'reference:{name}:{version}:{request.get_full_path()}'
+            etag = f'"{md5(key.encode()).hexdigest()}"'
+            last_modified = version // 10 ** 9
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+            if response is None:
+                data = cache.get(key)
+                if data is None:
+                    data = method(self, request, *args, **kwargs).data
+                    cache.set(key, data, settings.REFERENCE_CACHE_TIMEOUT)
+                response = Response(data)
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            return response
+        return wrapper
+    return decorator
+
+
+def cache_recipe_list(method):
+    """Кэширует список рецептов для пользователя и набора фильтров.
+
+    Ключ включает общее поколение рецептов и поколение данных
+    пользователя (избранное, корзина, подписки), поэтому изменения
+    сбрасывают кэш без перебора ключей. Счётчики избранного меняются
+    без сигналов рецепта, так что выборки по популярности дополнительно
+    зависят от поколения popularity. При RECIPE_CACHE_TIMEOUT = 0
+    кэш выключен.
+    """
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        timeout = settings.RECIPE_CACHE_TIMEOUT
+        if not timeout:
+            return method(self, request, *args, **kwargs)
+        user = request.user
+        if user.is_authenticated:
+            user_key = f'{user.id}:{get_version(f"user:{user.id}")}'
+        else:
+            user_key = 'anon'
+        params = urlencode(sorted(
+            (name, sorted(values))
+            for name, values in request.query_params.lists()
+        ), doseq=True)
+        generation = get_version('recipes')
+        if POPULARITY_PARAMS & request.query_params.keys():
+            generation = f'{generation}-{get_version("popularity")}'
+        key = 'recipes:{}:{}:{}'.format(
+            generation,
+            user_key,
+            md5(f'{request.get_host()}?{params}'.encode()).hexdigest()
+        )
+        data = cache.get(key)
+        if data is None:
+            count('recipes:misses')
+            data = method(self, request, *args, **kwargs).data
+            cache.set(key, data, timeout)
+            status = 'MISS'
+        else:
+            count('recipes:hits')
+            status = 'HIT'
+        response = Response(data)
+        response['X-Cache'] = status
+        return response
+    return wrapper
@@ -1,14 +1,36 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.core.cache import cache
+from django.db.models import (BooleanField, Exists, ExpressionWrapper,
+                              OuterRef, Q)
 from django_filters.rest_framework import FilterSet, filters
-from django_filters.rest_framework.filters import (AllValuesMultipleFilter,
-                                                   BooleanFilter,
-                                                   ModelChoiceFilter)
-from recipes.models import Recipe, Ingredient
+from django_filters.rest_framework.filters import (BooleanFilter, ChoiceFilter,
+                                                   ModelChoiceFilter,
+                                                   MultipleChoiceFilter,
+                                                   NumberFilter)
+from recipes.models import Recipe, RecipeTag, Ingredient, Tag
+from recipes.search import search_recipes
+
+from .cache import get_version
 
 User = get_user_model()
 
 
+def tag_map():
+    """Соответствие slug -> id тегов, хранится до изменения тегов."""
+    timeout = settings.REFERENCE_CACHE_TIMEOUT
+    key = f'tag_map:{get_version("tags", timeout)}'
+    tags = cache.get(key)
+    if tags is None:
+        tags = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, tags, timeout)
+    return tags
+
+
+def tag_choices():
+    return [(slug, slug) for slug in tag_map()]
+
+
 class IngredientFilter(FilterSet):
     """Фильтр по названию ингредиента."""
     name = filters.CharFilter(method='filter_name')
@@ -26,14 +48,29 @@ class IngredientFilter(FilterSet):
                 Q(name__istartswith=value),
                 output_field=BooleanField()
             )
-        ).order_by('-startswith')
+        ).order_by('-startswith', 'name')
 
 
 class RecipeFilter(FilterSet):
     author = ModelChoiceFilter(queryset=User.objects.all())
-    tags = AllValuesMultipleFilter(field_name='tags__slug')
+    tags = MultipleChoiceFilter(choices=tag_choices, method='tags_filter')
     is_favorited = BooleanFilter(method='is_favorited_filter')
     is_in_shopping_cart = BooleanFilter(method='is_in_shopping_cart_filter')
+    min_favorites = NumberFilter(field_name='favorites_count',
+                                 lookup_expr='gte')
+    ordering = ChoiceFilter(choices=(('popular', 'popular'),),
+                            method='ordering_filter')
+    search = filters.CharFilter(method='search_filter')
+
+    def tags_filter(self, queryset, name, value):
+        """Рецепты хотя бы с одним из тегов, без JOIN и DISTINCT."""
+        tags = tag_map()
+        return queryset.annotate(
+            has_tags=Exists(RecipeTag.objects.filter(
+                recipe=OuterRef('pk'),
+                tag_id__in=[tags[slug] for slug in value if slug in tags]
+            ))
+        ).filter(has_tags=True)
 
     def is_favorited_filter(self, queryset, name, value):
         if value and not self.request.user.is_anonymous:
@@ -45,6 +82,13 @@ class RecipeFilter(FilterSet):
             return queryset.filter(baskets__user=self.request.user)
         return queryset
 
+    def search_filter(self, queryset, name, value):
+        """Полнотекстовый поиск по названию, ингредиентам и описанию."""
+        return search_recipes(queryset, value)
+
+    def ordering_filter(self, queryset, name, value):
+        return queryset.order_by('-favorites_count', '-id')
+
     class Meta:
         model = Recipe
         fields = ('tags', 'author')
@@ -0,0 +1,150 @@
+import threading
+from collections import Counter, defaultdict
+from time import monotonic, perf_counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Верхние границы корзин гистограммы времени ответа, мс.
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+FIELDS = ('requests', 'queries', 'duplicates', 'db_us', 'serializer_us',
+          'total_us', *(f'le_{bound}' for bound in BUCKETS), 'le_inf')
+VIEWS_KEY = 'requeststats:views'
+
+_local = threading.local()
+
+
+class RequestStats:
+    """Запросы к БД и время одного HTTP-запроса.
+
+    Экземпляр передаётся в connection.execute_wrapper и считает
+    каждый выполненный SQL, одинаковые тексты запросов - кандидаты
+    в N+1.
+    """
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.statements = Counter()
+        self.depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values())
+
+    def most_repeated(self):
+        if not self.statements:
+            return None, 0
+        return self.statements.most_common(1)[0]
+
+
+def current_stats():
+    return getattr(_local, 'stats', None)
+
+
+def start_request():
+    _local.stats = RequestStats()
+    return _local.stats
+
+
+def finish_request():
+    _local.stats = None
+
+
+class TimedSerializerMixin:
+    """Добавляет время to_representation к статистике запроса.
+
+    Считается только внешний сериализатор, вложенные входят в его
+    время. Сюда же попадают запросы к БД, сделанные при сериализации.
+    """
+    def to_representation(self, instance):
+        stats = current_stats()
+        if stats is None or stats.depth:
+            return super().to_representation(instance)
+        stats.depth += 1
+        started = perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats.serializer_time += perf_counter() - started
+            stats.depth -= 1
+
+
+class ViewHistograms:
+    """Сводка по вьюхам в памяти процесса с периодическим сбросом в кэш.
+
+    Счётчики складываются через cache.incr, поэтому с общим кэшем
+    команда requeststats видит сумму по всем процессам.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = defaultdict(Counter)
+        self._flushed_at = monotonic()
+
+    def record(self, view, stats, total):
+        bucket = next(
+            (f'le_{bound}' for bound in BUCKETS if total * 1000 <= bound),
+            'le_inf'
+        )
+        with self._lock:
+            counter = self._views[view]
+            counter['requests'] += 1
+            counter['queries'] += stats.queries
+            counter['duplicates'] += stats.duplicates
+            counter['db_us'] += int(stats.db_time * 10 ** 6)
+            counter['serializer_us'] += int(stats.serializer_time * 10 ** 6)
+            counter['total_us'] += int(total * 10 ** 6)
+            counter[bucket] += 1
+            if (monotonic() - self._flushed_at
+                    < settings.REQUEST_STATS_FLUSH_INTERVAL):
+                return
+            views, self._views = self._views, defaultdict(Counter)
+            self._flushed_at = monotonic()
+        self.flush(views)
+
+    def flush(self, views):
+        known = cache.get(VIEWS_KEY, set())
+        if not views.keys() <= known:
+            cache.set(VIEWS_KEY, known | views.keys(), None)
+        for view, counter in views.items():
+            for field, value in counter.items():
+                key = f'requeststats:{view}:{field}'
+                cache.add(key, 0, None)
+                try:
+                    cache.incr(key, value)
+                except ValueError:
+                    pass
+
+
+def read_histograms():
+    """Сводка по вьюхам из кэша: {вьюха: {поле: значение}}."""
+    views = sorted(cache.get(VIEWS_KEY, set()))
+    keys = [f'requeststats:{view}:{field}'
+            for view in views for field in FIELDS]
+    values = cache.get_many(keys)
+    return {
+        view: {
+            field: values.get(f'requeststats:{view}:{field}', 0)
+            for field in FIELDS
+        } for view in views
+    }
+
+
+def reset_histograms():
+    views = cache.get(VIEWS_KEY, set())
+    cache.delete_many([f'requeststats:{view}:{field}'
+                       for view in views for field in FIELDS])
+    cache.delete(VIEWS_KEY)
+
+
+histograms = ViewHistograms()
@@ -0,0 +1,224 @@
+import json
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from time import perf_counter
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.db.backends.signals import connection_created
+from django.test.utils import (CaptureQueriesContext,
+                               setup_test_environment,
+                               teardown_test_environment)
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, ShoppingCart, Tag
+from users.models import Subscriptions
+
+User = get_user_model()
+
+
+def percentile(values, share):
+    """Перцентиль по ближайшему рангу для отсортированного списка."""
+    return values[max(ceil(share * len(values)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    """Команда замера задержек и числа запросов к БД по сценариям API.
+
+    Запросы идут через тестовый клиент в том же процессе, поэтому
+    замер не зависит от сети и веб-сервера. Данные готовит seeddata.
+    После каждого запроса соединения с БД закрываются по CONN_MAX_AGE,
+    как в настоящем обработчике, так что замеры с разными
+    DB_CONN_MAX_AGE и с пулом (DB_ENGINE=foodgram.postgresql_pool)
+    можно сравнивать.
+    """
+    help = 'measuring API latency and query count, prints JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', default=200, type=int,
+                            help='число запросов на сценарий')
+        parser.add_argument('--warmup', default=10, type=int)
+        parser.add_argument('--concurrency', default=1, type=int,
+                            help='число потоков, как у воркера gthread')
+        parser.add_argument('--scenario', action='append',
+                            help='запустить только указанные сценарии')
+        parser.add_argument('--seed', default=42, type=int)
+        parser.add_argument('--output', help='файл для JSON-отчёта')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.users = list(User.objects.filter(
+            username__startswith='bench'
+        ).order_by('id'))
+        if not self.users:
+            raise CommandError('Сначала загрузите данные: manage.py seeddata')
+        self.tags = list(Tag.objects.values_list('slug', flat=True))
+        self.ingredients = list(
+            Ingredient.objects.values_list('name', flat=True)[:500]
+        )
+        self.carts = list(ShoppingCart.objects.filter(
+            user__in=self.users
+        ).values_list('user_id', flat=True).distinct())
+        self.followers = list(Subscriptions.objects.filter(
+            user__in=self.users
+        ).values_list('user_id', flat=True).distinct())
+        scenarios = self.get_scenarios()
+        names = options['scenario'] or list(scenarios)
+        unknown = set(names) - set(scenarios)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные сценарии: {", ".join(sorted(unknown))}'
+            )
+        self.connects = 0
+        self.connects_lock = threading.Lock()
+        setup_test_environment()
+        connection_created.connect(self.count_connect)
+        try:
+            results = {
+                name: self.run(scenarios[name], options)
+                for name in names
+            }
+        finally:
+            connection_created.disconnect(self.count_connect)
+            teardown_test_environment()
+        report = json.dumps({
+            'environment': {
+                'database': connection.vendor,
+                'db_engine': connection.settings_dict['ENGINE'],
+                'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+                'pool_max_size': (
+                    connection.settings_dict.get('POOL', {}).get('MAX_SIZE')
+                    if self.pool() else None
+                ),
+                'django': django.get_version(),
+                'cache': settings.CACHES['default']['BACKEND'],
+                'recipe_cache_timeout': settings.RECIPE_CACHE_TIMEOUT,
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'seed': options['seed'],
+            },
+            'scenarios': results,
+        }, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(report)
+        self.stdout.write(report)
+
+    def get_scenarios(self):
+        """Сценарий - функция, возвращающая (пользователь, url)."""
+        rng = self.rng
+
+        def user(ids=None):
+            if ids:
+                return User(id=rng.choice(ids))
+            return rng.choice(self.users)
+
+        return {
+            'recipes': lambda: (
+                None, f'/api/recipes/?page={rng.randint(1, 5)}'
+            ),
+            'recipes_authenticated': lambda: (
+                user(), f'/api/recipes/?page={rng.randint(1, 5)}'
+            ),
+            'recipes_tags': lambda: (
+                user(), '/api/recipes/?' + '&'.join(
+                    f'tags={tag}' for tag in rng.sample(
+                        self.tags, min(2, len(self.tags))
+                    )
+                )
+            ),
+            'recipes_author': lambda: (
+                None, f'/api/recipes/?author={rng.choice(self.users).id}'
+            ),
+            'recipes_favorited': lambda: (
+                user(), '/api/recipes/?is_favorited=1'
+            ),
+            'recipes_popular': lambda: (
+                None, '/api/recipes/?ordering=popular'
+            ),
+            'ingredients_search': lambda: (
+                None, '/api/ingredients/?name='
+                + rng.choice(self.ingredients)[:rng.randint(1, 6)]
+            ),
+            'subscriptions': lambda: (
+                user(self.followers),
+                '/api/users/subscriptions/?recipes_limit=3'
+            ),
+            'feed': lambda: (
+                user(self.followers), '/api/recipes/feed/?cursor='
+            ),
+            'download_shopping_cart': lambda: (
+                user(self.carts),
+                '/api/recipes/download_shopping_cart/'
+            ),
+        }
+
+    def count_connect(self, **kwargs):
+        with self.connects_lock:
+            self.connects += 1
+
+    def pool(self):
+        return getattr(connection, 'pool', None)
+
+    def opened_connections(self):
+        """Сколько соединений с БД открыто на самом деле.
+
+        С пулом connection_created приходит и на соединение из пула,
+        поэтому считаются открытые пулом.
+        """
+        pool = self.pool()
+        if pool is not None:
+            return pool.totals['opened']
+        return self.connects
+
+    def run(self, scenario, options):
+        for _ in range(options['warmup']):
+            self.request(*scenario())
+        calls = [scenario() for _ in range(options['requests'])]
+        opened = self.opened_connections()
+        started = perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            results = list(pool.map(lambda call: self.measure(*call), calls))
+        elapsed = perf_counter() - started
+        timings = sorted(timing for timing, _, _ in results)
+        queries = [count for _, count, _ in results]
+        return {
+            'requests': len(timings),
+            'errors': sum(status >= 400 for _, _, status in results),
+            'p50_ms': round(percentile(timings, 0.50), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'p99_ms': round(percentile(timings, 0.99), 2),
+            'max_ms': round(timings[-1], 2),
+            'throughput_rps': round(len(timings) / elapsed, 1),
+            'queries_avg': round(sum(queries) / len(queries), 2),
+            'queries_max': max(queries),
+            'connections_opened': self.opened_connections() - opened,
+        }
+
+    def measure(self, user, url):
+        """Время в мс, число запросов к БД и статус одного запроса."""
+        with CaptureQueriesContext(connection) as context:
+            begin = perf_counter()
+            status = self.request(user, url)
+            timing = (perf_counter() - begin) * 1000
+        return timing, len(context), status
+
+    def request(self, user, url):
+        # Клиент создаётся заново: сброс авторизации через
+        # force_authenticate(None) обращается к таблице сессий.
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        response = client.get(url)
+        # Потоковый ответ нужно дочитать, иначе запросы к БД не пройдут.
+        if response.streaming:
+            b''.join(response.streaming_content)
+        # Тестовый клиент не закрывает соединения в конце запроса,
+        # в отличие от обработчика WSGI.
+        close_old_connections()
+        return response.status_code
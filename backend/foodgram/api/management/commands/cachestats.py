@@ -0,0 +1,23 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    """Команда вывода статистики кэша списка рецептов."""
+    help = 'showing hit/miss counters of the recipe list cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='reset counters after showing them')
+
+    def handle(self, *args, **options):
+        keys = ('stats:recipes:hits', 'stats:recipes:misses')
+        hits, misses = (cache.get(key, 0) for key in keys)
+        total = hits + misses
+        ratio = hits / total * 100 if total else 0
+        self.stdout.write(
+            f'Попаданий: {hits}, промахов: {misses}, '
+            f'доля попаданий: {ratio:.1f}%'
+        )
+        if options['reset']:
+            cache.delete_many(keys)
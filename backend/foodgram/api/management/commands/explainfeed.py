@@ -0,0 +1,45 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from recipes.models import Tag
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.views import RecipeViewSet
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """Команда вывода планов запросов ленты рецептов."""
+    help = 'printing EXPLAIN plans of the recipe feed queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int,
+                            help='id of the user to run queries as')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['user']:
+            users = users.filter(id=options['user'])
+        user = users.first()
+        if user is None:
+            raise CommandError('В базе нет пользователей')
+        tags = list(Tag.objects.values_list('slug', flat=True)[:2])
+        scenarios = {
+            'feed': {},
+            'tags': {'tags': tags},
+            'author': {'author': user.id},
+            'is_favorited': {'is_favorited': 1},
+            'is_in_shopping_cart': {'is_in_shopping_cart': 1},
+        }
+        factory = APIRequestFactory()
+        for name, params in scenarios.items():
+            request = Request(factory.get('/api/recipes/', params))
+            request.user = user
+            view = RecipeViewSet(
+                request=request, format_kwarg=None, action='list', kwargs={}
+            )
+            queryset = view.filter_queryset(view.get_queryset())
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{name} {params}'))
+            self.stdout.write(queryset[:6].explain())
+            self.stdout.write('')
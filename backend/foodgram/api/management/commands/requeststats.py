@@ -0,0 +1,71 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.instrumentation import (BUCKETS, read_histograms,
+                                 reset_histograms)
+from foodgram.postgresql_pool.pool import read_pool_stats
+
+
+def bucket_percentile(row, share):
+    """Верхняя граница корзины, в которую попадает перцентиль, мс."""
+    position = share * row['requests']
+    seen = 0
+    for bound in BUCKETS:
+        seen += row[f'le_{bound}']
+        if seen >= position:
+            return bound
+    return None
+
+
+class Command(BaseCommand):
+    """Команда вывода статистики запросов по вьюхам."""
+    help = 'showing per-view query count and timing histograms'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true',
+                            help='print raw counters as JSON')
+        parser.add_argument('--reset', action='store_true',
+                            help='reset counters after showing them')
+
+    def handle(self, *args, **options):
+        rows = read_histograms()
+        # Счётчики пула соединений, если включён DB_ENGINE с пулом;
+        # размеры - по процессам, сбросившим снимок недавно.
+        pool = read_pool_stats() if hasattr(connection, 'pool') else None
+        if options['json']:
+            if pool is not None:
+                rows['db_pool'] = pool
+            self.stdout.write(json.dumps(rows, indent=2))
+        else:
+            for view, row in rows.items():
+                requests = row['requests']
+                if not requests:
+                    continue
+                p50, p95 = (bucket_percentile(row, share)
+                            for share in (0.5, 0.95))
+                self.stdout.write(
+                    f'{view}: запросов {requests}, '
+                    f'SQL в среднем {row["queries"] / requests:.1f}, '
+                    f'повторов SQL {row["duplicates"] / requests:.1f}, '
+                    f'БД {row["db_us"] / requests / 1000:.1f} мс, '
+                    f'сериализация '
+                    f'{row["serializer_us"] / requests / 1000:.1f} мс, '
+                    f'всего {row["total_us"] / requests / 1000:.1f} мс, '
+                    f'p50 <= {p50 or "∞"} мс, p95 <= {p95 or "∞"} мс'
+                )
+            if pool is not None:
+                wait = pool['wait_us'] / max(pool['checkouts'], 1) / 1000
+                self.stdout.write(
+                    f'Пул соединений ({pool["processes"]} процессов): '
+                    f'открыто {pool["size"]}, '
+                    f'занято {pool["in_use"]}, свободно {pool["idle"]}, '
+                    f'выдано {pool["checkouts"]}, '
+                    f'ожидание в среднем {wait:.2f} мс, '
+                    f'отказов по таймауту {pool["timeouts"]}, '
+                    f'разорванных соединений '
+                    f'{pool["health_check_failures"]}'
+                )
+        if options['reset']:
+            reset_histograms()
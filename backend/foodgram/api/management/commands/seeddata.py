@@ -0,0 +1,179 @@
+import random
+from bisect import bisect_left
+from io import BytesIO
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from api.cache import bump_version
+from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredient,
+                            RecipeTag, ShoppingCart, Tag)
+from users.models import Subscriptions
+
+User = get_user_model()
+
+IMAGE_NAME = 'recipes/images/seed.png'
+UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+
+
+def zipf_weights(size, exponent=1.1):
+    """Накопленные веса: первые элементы популярнее остальных."""
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(size)))
+
+
+def weighted_sample(rng, population, cum_weights, k):
+    """Выборка k разных элементов с весами."""
+    k = min(k, len(population))
+    total = cum_weights[-1]
+    chosen = set()
+    while len(chosen) < k:
+        position = bisect_left(cum_weights, rng.random() * total)
+        chosen.add(population[min(position, len(population) - 1)])
+    return chosen
+
+
+class Command(BaseCommand):
+    """Команда генерации данных для нагрузочных замеров."""
+    help = 'generating users, recipes and user lists for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', default=200, type=int)
+        parser.add_argument('--recipes', default=2000, type=int)
+        parser.add_argument('--tags', default=12, type=int)
+        parser.add_argument('--ingredients', default=2000, type=int)
+        parser.add_argument('--favorites', default=20, type=int,
+                            help='среднее число рецептов в избранном')
+        parser.add_argument('--carts', default=5, type=int,
+                            help='среднее число рецептов в корзине')
+        parser.add_argument('--subscriptions', default=10, type=int,
+                            help='среднее число подписок')
+        parser.add_argument('--seed', default=42, type=int)
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username='bench0').exists():
+            raise CommandError('Данные для замеров уже загружены')
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            tags = self.create_tags(options['tags'])
+            ingredients = self.create_ingredients(options['ingredients'])
+            recipes = self.create_recipes(
+                rng, options['recipes'], users, tags, ingredients
+            )
+            self.create_user_lists(rng, users, recipes, options)
+        # bulk_create не отправляет сигналы: счётчики, списки покупок,
+        # поисковые документы, ленты подписок и версии кэша
+        # обновляются явно.
+        call_command('recountrecipes', stdout=self.stdout)
+        call_command('rebuildshoppinglist', stdout=self.stdout)
+        call_command('updatesearch', stdout=self.stdout)
+        call_command('rebuildfeeds', stdout=self.stdout)
+        for name in ('tags', 'ingredients', 'recipes', 'popularity'):
+            bump_version(name)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, рецептов: {len(recipes)}'
+        ))
+
+    def create_users(self, count):
+        password = make_password('benchmark')
+        User.objects.bulk_create(
+            User(
+                username=f'bench{number}',
+                email=f'bench{number}@example.com',
+                first_name='Тест',
+                last_name=f'Пользователь {number}',
+                password=password
+            ) for number in range(count)
+        )
+        return list(User.objects.filter(
+            username__startswith='bench'
+        ).order_by('id').values_list('id', flat=True))
+
+    def create_tags(self, count):
+        Tag.objects.bulk_create(
+            (Tag(name=f'Тег {number}', color=f'#{number:06X}',
+                 slug=f'bench-{number}') for number in range(count)),
+            ignore_conflicts=True
+        )
+        return list(Tag.objects.filter(
+            slug__startswith='bench-'
+        ).values_list('id', flat=True))
+
+    def create_ingredients(self, count):
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=f'ингредиент {number}',
+                        measurement_unit=UNITS[number % len(UNITS)])
+             for number in range(count)),
+            ignore_conflicts=True
+        )
+        return list(Ingredient.objects.filter(
+            name__startswith='ингредиент '
+        ).values_list('id', flat=True))
+
+    def create_recipes(self, rng, count, users, tags, ingredients):
+        if not default_storage.exists(IMAGE_NAME):
+            buffer = BytesIO()
+            Image.new('RGB', (600, 400), (200, 120, 60)).save(buffer, 'PNG')
+            default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+        # Немногие авторы пишут большую часть рецептов.
+        authors = zipf_weights(len(users))
+        Recipe.objects.bulk_create(
+            Recipe(
+                author_id=weighted_sample(rng, users, authors, 1).pop(),
+                name=f'Рецепт {number}',
+                image=IMAGE_NAME,
+                text='Описание рецепта для нагрузочных замеров',
+                cooking_time=rng.randint(5, 180)
+            ) for number in range(count)
+        )
+        recipes = list(Recipe.objects.filter(
+            author_id__in=users
+        ).order_by('id').values_list('id', flat=True))
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe_id=recipe, tag_id=tag)
+            for recipe in recipes
+            for tag in rng.sample(tags, min(rng.randint(1, 3), len(tags)))
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe_id=recipe, ingredient_id=ingredient,
+                             amount=rng.randint(1, 500))
+            for recipe in recipes
+            for ingredient in rng.sample(
+                ingredients, min(rng.randint(3, 12), len(ingredients))
+            )
+        )
+        return recipes
+
+    def create_user_lists(self, rng, users, recipes, options):
+        """Избранное, корзины и подписки с перекосом в популярное."""
+        # Популярность рецепта не связана с его id.
+        popular = rng.sample(recipes, len(recipes))
+        weights = zipf_weights(len(popular))
+        authors = zipf_weights(len(users))
+        for model, average in ((Favorites, options['favorites']),
+                               (ShoppingCart, options['carts'])):
+            model.objects.bulk_create(
+                model(user_id=user, recipe_id=recipe)
+                for user in users
+                for recipe in weighted_sample(
+                    rng, popular, weights,
+                    int(rng.expovariate(1 / average)) if average else 0
+                )
+            )
+        Subscriptions.objects.bulk_create(
+            Subscriptions(user_id=user, author_id=author)
+            for user in users
+            for author in weighted_sample(
+                rng, users, authors,
+                int(rng.expovariate(1 / options['subscriptions']))
+                if options['subscriptions'] else 0
+            )
+            if author != user
+        )
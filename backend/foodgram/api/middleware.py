@@ -0,0 +1,62 @@
+import json
+import logging
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from .instrumentation import finish_request, histograms, start_request
+
+logger = logging.getLogger('api.requests')
+
+
+class RequestStatsMiddleware:
+    """Число запросов к БД и время ответа для каждого запроса.
+
+    Добавляет заголовок Server-Timing, пишет строку JSON в лог
+    api.requests и копит гистограммы по вьюхам (команда requeststats).
+    Повторы одного SQL от REQUEST_STATS_DUPLICATE_THRESHOLD раз
+    попадают в лог предупреждением как вероятный N+1. Запросы,
+    сделанные при отдаче потокового ответа, не учитываются.
+    """
+    def __init__(self, get_response):
+        if not settings.REQUEST_STATS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = start_request()
+        try:
+            with connection.execute_wrapper(stats):
+                response = self.get_response(request)
+        finally:
+            finish_request()
+        total = perf_counter() - stats.started
+        match = request.resolver_match
+        view = f'{request.method}:{match.view_name if match else "-"}'
+        histograms.record(view, stats, total)
+        response['Server-Timing'] = (
+            f'db;dur={stats.db_time * 1000:.1f};'
+            f'desc="{stats.queries} queries", '
+            f'serializer;dur={stats.serializer_time * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+        sql, repeats = stats.most_repeated()
+        record = {
+            'view': view,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.queries,
+            'duplicates': stats.duplicates,
+            'db_ms': round(stats.db_time * 1000, 1),
+            'serializer_ms': round(stats.serializer_time * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+        }
+        if repeats >= settings.REQUEST_STATS_DUPLICATE_THRESHOLD:
+            record['repeated_sql'] = sql[:500]
+            record['repeats'] = repeats
+            logger.warning(json.dumps(record, ensure_ascii=False))
+        elif logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(record, ensure_ascii=False))
+        return response
@@ -1,6 +1,119 @@
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import AutoField, IntegerField, Q, QuerySet
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPagination(PageNumberPagination):
+    """Постраничная пагинация с необязательным режимом курсора.
+
+    С параметром cursor выдача идёт по ключу сортировки после курсора
+    без OFFSET и без COUNT(*): количество считается, только если
+    передан count=true. Пустой cursor означает первую страницу.
+    Курсор - значения полей сортировки последней записи через запятую
+    (при сортировке по id - просто id). Готовые списки и сортировки
+    не по целочисленным полям модели (например, по рангу поиска)
+    всегда делятся на страницы по номеру.
+    """
     page_size_query_param = 'limit'
     page_size = 6
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_fields = None
+        if (self.cursor_query_param in request.query_params
+                and isinstance(queryset, QuerySet)):
+            self.cursor_fields = self.get_cursor_fields(queryset)
+        self.cursor_mode = self.cursor_fields is not None
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        page_size = self.get_page_size(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'true':
+            self.count = queryset.count()
+        cursor = request.query_params[self.cursor_query_param]
+        if cursor:
+            queryset = queryset.filter(self.get_cursor_filter(cursor))
+        page = list(queryset.order_by(*self.cursor_fields)[:page_size + 1])
+        self.next_cursor = None
+        if len(page) > page_size:
+            last = page[page_size - 1]
+            self.next_cursor = ','.join(
+                str(getattr(last, field.lstrip('-')))
+                for field in self.cursor_fields
+            )
+        return page[:page_size]
+
+    def get_cursor_fields(self, queryset):
+        """Сортировка queryset, дополненная id, или None.
+
+        Ключом можно идти только по целочисленным полям самой модели,
+        id в конце делает ключ уникальным.
+        """
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        fields = []
+        for name in ordering or ('-id',):
+            if not isinstance(name, str):
+                return None
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            if name == 'pk':
+                name = 'id'
+            try:
+                field = queryset.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if field.is_relation or not isinstance(
+                field, (AutoField, IntegerField)
+            ):
+                return None
+            fields.append(f'-{name}' if descending else name)
+            if name == 'id':
+                return fields
+        fields.append('-id' if fields[0].startswith('-') else 'id')
+        return fields
+
+    def get_cursor_filter(self, cursor):
+        """Условие на записи строго после курсора."""
+        values = cursor.split(',')
+        if len(values) != len(self.cursor_fields) or not all(
+            value.lstrip('-').isdigit() for value in values
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.cursor_fields, map(int, values)):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if self.next_cursor is None:
+            return None
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.count_query_param
+        )
+        return replace_query_param(
+            url, self.cursor_query_param, self.next_cursor
+        )
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['results'] = data
+        return Response(response)
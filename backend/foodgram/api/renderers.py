@@ -0,0 +1,56 @@
+import csv
+
+from rest_framework.renderers import BaseRenderer
+
+
+class Echo:
+    """Псевдобуфер: csv.writer пишет в него строку и сразу её получает."""
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Базовый рендерер списка покупок.
+
+    Список отдаётся по частям через stream(), обычный render() нужен
+    только для ответов с ошибками.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            return ''.join(f'{value}\n' for value in data.values())
+        return ''.join(self.stream(data))
+
+    def stream(self, ingredients):
+        raise NotImplementedError
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        for ingredient in ingredients:
+            yield (f'* {ingredient["ingredient__name"]} '
+                   f'({ingredient["ingredient__measurement_unit"]}) -- '
+                   f'{ingredient["amount"]}\n\n')
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(
+            ('Ингредиент', 'Единица измерения', 'Количество')
+        )
+        for ingredient in ingredients:
+            yield writer.writerow((
+                ingredient['ingredient__name'],
+                ingredient['ingredient__measurement_unit'],
+                ingredient['amount']
+            ))
@@ -1,30 +1,68 @@
 from base64 import b64decode
+from binascii import Error as Base64Error
 
-from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import transaction
 from django.forms import BooleanField
-from recipes.models import Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag
-from rest_framework.serializers import (BooleanField, CharField, ImageField,
-                                        ModelSerializer, ValidationError)
+from recipes.images import schedule_variants, variant_urls
+from recipes.models import (Ingredient, Recipe, RecipeIngredient, RecipeTag,
+                            ShoppingListItem, Tag)
+from recipes.matching import recipe_match_index
+from recipes.search import update_search_documents
+from rest_framework.serializers import (BooleanField, CharField, FloatField,
+                                        ImageField, IntegerField, ListField,
+                                        ModelSerializer, Serializer,
+                                        SerializerMethodField,
+                                        ValidationError)
 from rest_framework.status import HTTP_400_BAD_REQUEST
 from users.serializers import CustomUserSerializer
 
+from .instrumentation import TimedSerializerMixin
 
-class IngredientSerializer(ModelSerializer):
+MAX_AMOUNT = 32767
+
+
+class IngredientSerializer(TimedSerializerMixin, ModelSerializer):
     class Meta:
         model = Ingredient
         fields = '__all__'
 
 
-class TagSerializer(ModelSerializer):
+class TagSerializer(TimedSerializerMixin, ModelSerializer):
     class Meta:
         model = Tag
         fields = '__all__'
 
 
-class ShortRecipeSerializer(ModelSerializer):
+class ImageVariantsMixin:
+    """Ссылки на уменьшенные копии картинки рецепта."""
+    def get_image_variants(self, obj):
+        return variant_urls(obj, self.context.get('request'))
+
+
+class ShortRecipeSerializer(TimedSerializerMixin, ImageVariantsMixin,
+                            ModelSerializer):
+    image_variants = SerializerMethodField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+
+class RecipeBatchSerializer(Serializer):
+    """Список id рецептов для пакетного добавления и удаления."""
+    recipes = ListField(child=IntegerField(min_value=1), allow_empty=False)
+
+    def validate_recipes(self, recipes):
+        """Убирает повторы и получает рецепты одним запросом."""
+        ids = list(dict.fromkeys(recipes))
+        found = Recipe.objects.in_bulk(ids)
+        missing = [str(recipe) for recipe in ids if recipe not in found]
+        if missing:
+            raise ValidationError(
+                f'Рецептов не существует: {", ".join(missing)}'
+            )
+        return [found[recipe] for recipe in ids]
 
 
 class IngredientRecipeSerializer(ModelSerializer):
@@ -38,16 +76,42 @@ class IngredientRecipeSerializer(ModelSerializer):
 
 
 class Base64ImageField(ImageField):
-    """This class decrypts the picture."""
+    """This class decrypts the picture.
+
+    Base64 is decoded chunk by chunk into a temporary file, so the decoded
+    image is never held in memory as a whole and Pillow validates it
+    straight from disk.
+    """
+    chunk_size = 64 * 1024
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(b64decode(imgstr), name='temp.' + ext)
+            data = self.decode(data)
         return super().to_internal_value(data)
 
+    def decode(self, data):
+        header_end = data.find(';base64,')
+        if header_end == -1:
+            self.fail('invalid')
+        ext = data[len('data:image/'):header_end]
+        upload = TemporaryUploadedFile(
+            'temp.' + ext, 'image/' + ext, 0, None
+        )
+        start = header_end + len(';base64,')
+        try:
+            for position in range(start, len(data), self.chunk_size):
+                upload.write(
+                    b64decode(data[position:position + self.chunk_size])
+                )
+        except Base64Error:
+            self.fail('invalid')
+        upload.size = upload.tell()
+        upload.seek(0)
+        return upload
+
 
-class RecipeSerializer(ModelSerializer):
+class RecipeSerializer(TimedSerializerMixin, ImageVariantsMixin,
+                       ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     ingredients = IngredientRecipeSerializer(
         many=True,
@@ -58,6 +122,7 @@ class RecipeSerializer(ModelSerializer):
     is_favorited = BooleanField(read_only=True, default=None)
     is_in_shopping_cart = BooleanField(read_only=True, default=None)
     image = Base64ImageField()
+    image_variants = SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -68,91 +133,203 @@ class RecipeSerializer(ModelSerializer):
             'ingredients',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time',
             'is_favorited',
             'is_in_shopping_cart'
         )
 
+    @transaction.atomic
     def create(self, validated_data):
-        tags = self.initial_data.get('tags')
-        ingredients = self.initial_data.get('ingredients')
+        tags = validated_data.pop('tags')
+        ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(**validated_data)
-        for tag in tags:
-            RecipeTag.objects.create(tag_id=tag, recipe=recipe)
-
+        validated_data['image'].close()
+        RecipeTag.objects.bulk_create(
+            RecipeTag(tag=tag, recipe=recipe) for tag in tags
+        )
         RecipeIngredient.objects.bulk_create(
             RecipeIngredient(
                 recipe=recipe,
-                ingredient_id=ingredient.get('id'),
-                amount=ingredient.get('amount')
+                ingredient=ingredient['ingredient'],
+                amount=ingredient['amount']
             ) for ingredient in ingredients)
+        # Документ и индекс подбора обновляются один раз, когда у
+        # рецепта уже есть ингредиенты.
+        update_search_documents((recipe.id,))
+        recipe_match_index.mark_stale((recipe.id,))
+        schedule_variants(recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.image = validated_data.get('image', instance.image)
+        if 'image' in validated_data:
+            instance.image = validated_data['image']
+            instance.image_variants_ready = False
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
         instance.cooking_time = validated_data.get(
             'cooking_time',
             instance.cooking_time
         )
-        tags = self.initial_data.get('tags')
-        RecipeTag.objects.filter(recipe=instance).delete()
-        RecipeTag.objects.bulk_create(
-            RecipeTag(
-                tag_id=tag,
-                recipe=instance,
+        self.set_tags(instance, validated_data['tags'])
+        changed = self.set_ingredients(instance, validated_data['ingredients'])
+        if changed:
+            ShoppingListItem.objects.refresh(
+                instance.baskets.values('user'), changed
+            )
+            recipe_match_index.mark_stale((instance.id,))
+        # Сохранение рецепта обновляет поисковый документ (сигнал
+        # post_save) уже с новыми ингредиентами.
+        instance.save()
+        if 'image' in validated_data:
+            validated_data['image'].close()
+            schedule_variants(instance)
+        return instance
 
-            ) for tag in tags)
+    def set_tags(self, recipe, tags):
+        """Приводит теги рецепта к переданным, меняя только разницу."""
+        current = set(recipe.recipetag_set.values_list('tag_id', flat=True))
+        tags = {tag.id for tag in tags}
+        if current - tags:
+            RecipeTag.objects.filter(
+                recipe=recipe, tag_id__in=current - tags
+            ).delete()
+        RecipeTag.objects.bulk_create(
+            RecipeTag(tag_id=tag, recipe=recipe) for tag in tags - current
+        )
 
-        ingredients = self.initial_data.get('ingredients')
-        RecipeIngredient.objects.filter(recipe=instance).delete()
+    def set_ingredients(self, recipe, ingredients):
+        """Приводит ингредиенты рецепта к переданным.
 
+        Удаляются, добавляются и обновляются только изменившиеся строки.
+        Возвращает id ингредиентов, количество которых поменялось.
+        """
+        current = {
+            row.ingredient_id: row
+            for row in recipe.recipeingredient_set.all()
+        }
+        amounts = {
+            ingredient['ingredient'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        removed = current.keys() - amounts.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+        changed = [
+            current[ingredient_id]
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id in current
+            and current[ingredient_id].amount != amount
+        ]
+        for row in changed:
+            row.amount = amounts[row.ingredient_id]
+        RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        added = amounts.keys() - current.keys()
         RecipeIngredient.objects.bulk_create(
             RecipeIngredient(
-                recipe=instance,
-                ingredient_id=ingredient.get('id'),
-                amount=ingredient.get('amount')
-            ) for ingredient in ingredients)
-
-        instance.save()
-        return instance
+                recipe=recipe,
+                ingredient_id=ingredient_id,
+                amount=amounts[ingredient_id]
+            ) for ingredient_id in added)
+        return removed | added | {row.ingredient_id for row in changed}
 
     def validate(self, data):
-        ingredients = self.initial_data.get('ingredients')
-        tags = self.initial_data.get('tags')
-        if not ingredients:
-            raise ValidationError(
-                {'ingredients': ('В рецепте должен быть использован '
-                                 'минимум один ингредиент')
-                 }
-            )
-        array_of_ingredients = []
-        for ingredient in ingredients:
+        data['tags'] = self.parse_tags(self.initial_data.get('tags'))
+        data['ingredients'] = self.parse_ingredients(
+            self.initial_data.get('ingredients')
+        )
+        return data
 
-            if ingredient['id'] in array_of_ingredients:
-                raise ValidationError(
-                    detail='Ингредиенты не должны дублироваться',
-                    code=HTTP_400_BAD_REQUEST
-                )
-            if int(ingredient.get('amount')) < 1:
-                raise ValidationError(
-                    {'amount': ('Количество ингредиента в рецепте '
-                                     'должно быть больше 0')},
-                    code=HTTP_400_BAD_REQUEST
-                )
-            array_of_ingredients.append(ingredient['id'])
-        if not tags:
-            raise ValidationError(
-                {'tags': ('Рецепт должен быть привязан '
-                          'минимум к одному тегу')
-                 }
-            )
-        array_of_tags = set(tags)
-        if len(array_of_tags) != len(tags):
+    def require_list(self, field, value, empty_message):
+        """Проверяет, что в поле передан непустой список."""
+        if not value:
+            raise ValidationError({field: empty_message})
+        if not isinstance(value, list):
+            raise ValidationError({field: 'Ожидается список'})
+
+    def parse_tags(self, tags):
+        """Проверяет id тегов и получает их одним запросом."""
+        self.require_list(
+            'tags', tags, 'Рецепт должен быть привязан минимум к одному тегу'
+        )
+        try:
+            ids = [int(tag) for tag in tags]
+        except (TypeError, ValueError):
+            raise ValidationError({'tags': 'Некорректный id тега'})
+        if len(set(ids)) != len(ids):
             raise ValidationError(
                 detail='Теги не должны дублироваться в рецепте',
                 code=HTTP_400_BAD_REQUEST
             )
-        return data
+        found = Tag.objects.in_bulk(ids)
+        missing = [str(tag) for tag in ids if tag not in found]
+        if missing:
+            raise ValidationError(
+                {'tags': f'Тегов не существует: {", ".join(missing)}'}
+            )
+        return [found[tag] for tag in ids]
+
+    def parse_ingredients(self, ingredients):
+        """Проверяет ингредиенты рецепта и получает их одним запросом.
+
+        Ошибки возвращаются списком по позициям, пустой словарь означает,
+        что в позиции ошибок нет.
+        """
+        self.require_list(
+            'ingredients', ingredients,
+            'В рецепте должен быть использован минимум один ингредиент'
+        )
+        errors = [{} for _ in ingredients]
+        items = []
+        seen = set()
+        for position, ingredient in enumerate(ingredients):
+            try:
+                ingredient_id, amount = self.parse_ingredient(ingredient)
+            except (KeyError, TypeError, ValueError):
+                errors[position]['id'] = [
+                    'Укажите id и количество ингредиента'
+                ]
+                continue
+            if ingredient_id in seen:
+                errors[position]['id'] = [
+                    'Ингредиенты не должны дублироваться'
+                ]
+            seen.add(ingredient_id)
+            if not 1 <= amount <= MAX_AMOUNT:
+                errors[position]['amount'] = [
+                    'Количество ингредиента в рецепте должно быть '
+                    f'от 1 до {MAX_AMOUNT}'
+                ]
+            items.append((position, ingredient_id, amount))
+        found = Ingredient.objects.in_bulk(seen)
+        for position, ingredient_id, _ in items:
+            if ingredient_id not in found:
+                errors[position]['id'] = ['Ингредиент не найден']
+        if any(errors):
+            raise ValidationError({'ingredients': errors})
+        return [
+            {'ingredient': found[ingredient_id], 'amount': amount}
+            for _, ingredient_id, amount in items
+        ]
+
+    def parse_ingredient(self, ingredient):
+        """id и количество из объекта ингредиента в запросе."""
+        if not isinstance(ingredient, dict):
+            raise TypeError('ingredient must be an object')
+        return int(ingredient['id']), int(ingredient['amount'])
+
+
+class MatchedRecipeSerializer(RecipeSerializer):
+    """Рецепт с покрытием набора ингредиентов пользователя."""
+    matched_ingredients = IntegerField(read_only=True)
+    total_ingredients = IntegerField(read_only=True)
+    coverage = FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + (
+            'matched_ingredients', 'total_ingredients', 'coverage'
+        )
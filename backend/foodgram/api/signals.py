@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from recipes.models import (Favorites, Ingredient, Recipe, ShoppingCart,
+                            Tag)
+from users.models import Subscriptions
+
+from .cache import bump_version_on_commit
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def bump_tags_version(sender, **kwargs):
+    bump_version_on_commit('tags', settings.REFERENCE_CACHE_TIMEOUT)
+    bump_version_on_commit('recipes')
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def bump_ingredients_version(sender, **kwargs):
+    bump_version_on_commit('ingredients', settings.REFERENCE_CACHE_TIMEOUT)
+    bump_version_on_commit('recipes')
+
+
+# Теги и ингредиенты рецепта меняются только вместе с самим рецептом
+# (RecipeSerializer сохраняет его последним), поэтому сигналов на их
+# строки нет: удаление этих строк остаётся быстрым, без выборки.
+@receiver((post_save, post_delete), sender=Recipe)
+def bump_recipes_version(sender, **kwargs):
+    bump_version_on_commit('recipes')
+
+
+@receiver((post_save, post_delete), sender=Favorites)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+@receiver((post_save, post_delete), sender=Subscriptions)
+def bump_user_version(sender, instance, **kwargs):
+    bump_version_on_commit(f'user:{instance.user_id}')
+
+
+@receiver((post_save, post_delete), sender=Favorites)
+def bump_popularity_version(sender, **kwargs):
+    bump_version_on_commit('popularity')
@@ -0,0 +1,417 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredient,
+                            RecipeTag, ShoppingCart, ShoppingListItem, Tag)
+from rest_framework.test import APIClient
+from users.models import Subscriptions
+
+User = get_user_model()
+
+
+def create_recipes(author, count, tags, ingredients):
+    """Рецепты, у каждого несколько тегов и ингредиентов."""
+    Recipe.objects.bulk_create(
+        Recipe(author=author, name=f'Рецепт {number}', text='Описание',
+               image='recipes/images/test.png', cooking_time=10)
+        for number in range(count)
+    )
+    recipes = list(Recipe.objects.filter(author=author).order_by('id'))
+    RecipeTag.objects.bulk_create(
+        RecipeTag(recipe=recipe, tag=tags[(number + shift) % len(tags)])
+        for number, recipe in enumerate(recipes)
+        for shift in range(number % 3 + 1)
+    )
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(
+            recipe=recipe,
+            ingredient=ingredients[(number + shift) % len(ingredients)],
+            amount=shift + 1
+        )
+        for number, recipe in enumerate(recipes)
+        for shift in range(number % 4 + 2)
+    )
+    return recipes
+
+
+class RecipeQueryCountTest(TestCase):
+    """Число запросов к БД у списка и рецепта не зависит от размера."""
+    # Список: страница, COUNT, теги, ингредиенты.
+    LIST_QUERIES = 4
+    # Авторизованный: ещё подписки пользователя для is_subscribed.
+    LIST_QUERIES_AUTHENTICATED = 5
+    # Рецепт: сам рецепт, теги, ингредиенты.
+    RETRIEVE_QUERIES = 3
+    RETRIEVE_QUERIES_AUTHENTICATED = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass'
+        )
+        tags = [
+            Tag.objects.create(name=f'Тег {number}', color=f'#00000{number}',
+                               slug=f'tag-{number}')
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Продукт {number}',
+                                      measurement_unit='г')
+            for number in range(6)
+        ]
+        cls.recipes = create_recipes(cls.author, 15, tags, ingredients)
+        Subscriptions.objects.create(user=cls.user, author=cls.author)
+        Favorites.objects.create(user=cls.user, recipe=cls.recipes[0])
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.recipes[1])
+
+    def setUp(self):
+        cache.clear()
+        self.anonymous = APIClient()
+        self.authenticated = APIClient()
+        self.authenticated.force_authenticate(self.user)
+
+    def test_list(self):
+        for client, queries in (
+            (self.anonymous, self.LIST_QUERIES),
+            (self.authenticated, self.LIST_QUERIES_AUTHENTICATED),
+        ):
+            for limit in (3, 6, 12):
+                with self.subTest(user=client is self.authenticated,
+                                  limit=limit):
+                    with self.assertNumQueries(queries):
+                        response = client.get(
+                            f'/api/recipes/?limit={limit}'
+                        )
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(len(response.data['results']), limit)
+
+    def test_retrieve(self):
+        recipe = self.recipes[0]
+        for client, queries in (
+            (self.anonymous, self.RETRIEVE_QUERIES),
+            (self.authenticated, self.RETRIEVE_QUERIES_AUTHENTICATED),
+        ):
+            with self.subTest(user=client is self.authenticated):
+                with self.assertNumQueries(queries):
+                    response = client.get(f'/api/recipes/{recipe.id}/')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data['id'], recipe.id)
+
+
+class RecipeTagFilterTest(TestCase):
+    """Фильтр по тегам не дублирует рецепты с несколькими тегами."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}', color=f'#0000{number:02}',
+                               slug=f'tag-{number}')
+            for number in range(10)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Продукт {number}',
+                                      measurement_unit='г')
+            for number in range(5)
+        ]
+        create_recipes(author, 60, cls.tags, ingredients)
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_filtered(self, slugs):
+        query = '&'.join(f'tags={slug}' for slug in slugs)
+        response = APIClient().get(f'/api/recipes/?{query}&limit=1000')
+        self.assertEqual(response.status_code, 200)
+        ids = [recipe['id'] for recipe in response.data['results']]
+        self.assertEqual(len(ids), len(set(ids)))
+        expected = Recipe.objects.filter(
+            tags__slug__in=slugs
+        ).distinct().count()
+        self.assertEqual(len(ids), expected)
+        self.assertEqual(response.data['count'], expected)
+
+    def test_every_tag(self):
+        self.assert_filtered([tag.slug for tag in self.tags])
+
+    def test_tag_pairs(self):
+        for first, second in zip(self.tags, self.tags[1:]):
+            with self.subTest(tags=(first.slug, second.slug)):
+                self.assert_filtered([first.slug, second.slug])
+
+    def test_single_tag(self):
+        for tag in self.tags:
+            with self.subTest(tag=tag.slug):
+                self.assert_filtered([tag.slug])
+
+
+class CursorPaginationTest(TestCase):
+    """Курсор проходит список так же, как номера страниц."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+        tags = [
+            Tag.objects.create(name=f'Тег {number}', color=f'#00000{number}',
+                               slug=f'tag-{number}')
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Продукт {number}',
+                                      measurement_unit='г')
+            for number in range(5)
+        ]
+        recipes = create_recipes(author, 20, tags, ingredients)
+        # Много одинаковых значений: порядок внутри них задаёт id.
+        for number, recipe in enumerate(recipes):
+            recipe.favorites_count = number % 3
+        Recipe.objects.bulk_update(recipes, ('favorites_count',))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def walk_pages(self, query):
+        ids = []
+        url = f'/api/recipes/?{query}&limit=3&page=1'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def walk_cursor(self, query):
+        ids = []
+        url = f'/api/recipes/?{query}&limit=3&cursor='
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_orderings(self):
+        for query, expected in (
+            ('', Recipe.objects.order_by('-id')),
+            ('ordering=popular',
+             Recipe.objects.order_by('-favorites_count', '-id')),
+            ('tags=tag-0&tags=tag-1',
+             Recipe.objects.filter(
+                 tags__slug__in=('tag-0', 'tag-1')
+             ).distinct().order_by('-id')),
+            ('ordering=popular&min_favorites=1',
+             Recipe.objects.filter(favorites_count__gte=1).order_by(
+                 '-favorites_count', '-id'
+             )),
+        ):
+            with self.subTest(query=query):
+                ids = self.walk_cursor(query)
+                self.assertEqual(ids, self.walk_pages(query))
+                self.assertEqual(
+                    ids, list(expected.values_list('id', flat=True))
+                )
+
+    def test_count_on_request(self):
+        response = self.client.get('/api/recipes/?cursor=&count=true')
+        self.assertEqual(response.data['count'], Recipe.objects.count())
+
+    def test_malformed_cursor(self):
+        for cursor in ('abc', '1,2,3', '1;2', '--1'):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(
+                    f'/api/recipes/?ordering=popular&cursor={cursor}'
+                )
+                self.assertEqual(response.status_code, 404)
+
+
+class RecipeBatchTest(TestCase):
+    """Пакетные избранное и корзина меняют счётчики ровно на изменённое."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass'
+        )
+        cls.other = User.objects.create_user(
+            username='other', email='other@example.com', password='pass'
+        )
+        tags = [
+            Tag.objects.create(name=f'Тег {number}', color=f'#00000{number}',
+                               slug=f'tag-{number}')
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Продукт {number}',
+                                      measurement_unit='г')
+            for number in range(5)
+        ]
+        cls.recipes = create_recipes(cls.user, 4, tags, ingredients)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_counts(self, counter, expected):
+        self.assertEqual(
+            list(Recipe.objects.filter(
+                id__in=[recipe.id for recipe in self.recipes]
+            ).order_by('id').values_list(counter, flat=True)),
+            expected
+        )
+
+    def check_batch(self, model, url, counter):
+        first, second, third, fourth = (recipe.id for recipe in self.recipes)
+        model.objects.create(user=self.other, recipe_id=first)
+        self.client.post(f'/api/recipes/{first}/{url}/')
+        self.assert_counts(counter, [2, 0, 0, 0])
+
+        # first уже добавлен, повторы в запросе считаются один раз.
+        response = self.client.post(
+            f'/api/recipes/{url}/',
+            {'recipes': [first, second, second, third, third]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data],
+            [first, second, third]
+        )
+        self.assert_counts(counter, [2, 1, 1, 0])
+        self.assertEqual(model.objects.filter(user=self.user).count(), 3)
+
+        response = self.client.delete(
+            f'/api/recipes/{url}/',
+            {'recipes': [first, first, second, fourth]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assert_counts(counter, [1, 0, 1, 0])
+        self.assertEqual(
+            list(model.objects.filter(user=self.user).values_list(
+                'recipe_id', flat=True
+            )),
+            [third]
+        )
+
+        response = self.client.post(
+            f'/api/recipes/{url}/', {'recipes': [first, 10 ** 6]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assert_counts(counter, [1, 0, 1, 0])
+
+    def test_favorites(self):
+        self.check_batch(Favorites, 'favorite', 'favorites_count')
+
+    def test_shopping_cart(self):
+        self.check_batch(ShoppingCart, 'shopping_cart', 'cart_count')
+        self.assertEqual(
+            set(ShoppingListItem.objects.filter(user=self.user).values_list(
+                'ingredient_id', flat=True
+            )),
+            set(self.recipes[2].ingredients.values_list('id', flat=True))
+        )
+
+
+class RecipeValidationTest(TestCase):
+    """Теги и ингредиенты не того типа дают 400, а не 500."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+        cls.tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        ingredients = [
+            Ingredient.objects.create(name=f'Продукт {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        cls.ingredient = ingredients[0]
+        cls.recipe = create_recipes(cls.author, 1, [cls.tag], ingredients)[0]
+
+    def test_invalid_types(self):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        ingredients = [{'id': self.ingredient.id, 'amount': 1}]
+        for tags, ingredients in (
+            ([self.tag.id], 5),
+            ([self.tag.id], 'ингредиенты'),
+            ([self.tag.id], {'id': self.ingredient.id, 'amount': 1}),
+            ([self.tag.id], [5]),
+            ([self.tag.id], [[self.ingredient.id, 1]]),
+            (5, ingredients),
+            ({'id': self.tag.id}, ingredients),
+            ([{'id': self.tag.id}], ingredients),
+        ):
+            with self.subTest(tags=tags, ingredients=ingredients):
+                response = client.patch(
+                    f'/api/recipes/{self.recipe.id}/',
+                    {'tags': tags, 'ingredients': ingredients},
+                    format='json'
+                )
+                self.assertEqual(response.status_code, 400)
+
+
+class DownloadShoppingCartTest(TestCase):
+    """Выгрузка списка покупок при разных Accept."""
+    URL = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='pass'
+        )
+        tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        ingredients = [
+            Ingredient.objects.create(name=f'Продукт {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        recipe = create_recipes(cls.user, 1, [tag], ingredients)[0]
+        ShoppingCart.objects.add_recipes(cls.user, [recipe.id])
+        ShoppingListItem.objects.refresh((cls.user.id,))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def download(self, accept, client=None):
+        response = (client or self.client).get(self.URL, HTTP_ACCEPT=accept)
+        content = b''.join(getattr(response, 'streaming_content', ()))
+        return response, content.decode()
+
+    def test_text_for_any_accept(self):
+        for accept in ('*/*', 'application/json', 'text/plain'):
+            with self.subTest(accept=accept):
+                response, content = self.download(accept)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response['Content-Type'].startswith(
+                    'text/plain'
+                ))
+                self.assertIn('* Продукт 0 (г) -- ', content)
+
+    def test_csv(self):
+        response, content = self.download('text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(content.startswith('Ингредиент,'))
+
+    def test_errors_in_json(self):
+        response = APIClient().get(self.URL, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        ShoppingCart.objects.remove_recipes(
+            self.user, Recipe.objects.values_list('id', flat=True)
+        )
+        response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('errors', response.json())
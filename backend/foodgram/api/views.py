@@ -1,20 +1,38 @@
-from django.db.models import Exists, OuterRef, Sum
-from django.http import HttpResponse
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import (BooleanField, Exists, OuterRef, Prefetch, Sum,
+                              Value)
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
+from recipes.autocomplete import ingredient_index
+from recipes.feed import read_feed
+from recipes.matching import recipe_match_index
 from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
+                            ShoppingCart, ShoppingListItem, SimilarRecipe,
+                            Tag)
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from .filters import IngredientFilter
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.status import (HTTP_201_CREATED, HTTP_204_NO_CONTENT,
                                    HTTP_400_BAD_REQUEST)
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
+from users.models import Subscriptions
 
+from .cache import (bump_version_on_commit, cache_recipe_list,
+                    cache_reference)
 from .filters import RecipeFilter
 from .permissions import AuthorOrReadOnly, IsAdmin
-from .serializers import (IngredientSerializer, RecipeSerializer,
+from .renderers import (CSVShoppingListRenderer, ShoppingListRenderer,
+                        TextShoppingListRenderer)
+from .serializers import (IngredientSerializer, MatchedRecipeSerializer,
+                          RecipeBatchSerializer, RecipeSerializer,
                           ShortRecipeSerializer, TagSerializer)
 
 
@@ -27,6 +45,21 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     search_fields = ('^name',)
     filterset_class = IngredientFilter
 
+    @cache_reference('ingredients')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @cache_reference('ingredients')
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        limit = request.query_params.get('limit')
+        limit = int(limit) if limit and limit.isdigit() else None
+        if name and settings.INGREDIENT_INDEX_ENABLED:
+            return Response(ingredient_index.search(name, limit))
+        queryset = self.filter_queryset(self.get_queryset())[:limit]
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
 
 class TagViewSet(ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
@@ -34,6 +67,14 @@ class TagViewSet(ReadOnlyModelViewSet):
     permission_classes = (IsAdmin,)
     pagination_class = None
 
+    @cache_reference('tags')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @cache_reference('tags')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 class RecipeViewSet(ModelViewSet):
     """Вьюсет для работы с моделью рецептов."""
@@ -44,21 +85,62 @@ class RecipeViewSet(ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'recipeingredient_set',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            )
+        )
+        if user.is_anonymous:
+            return queryset.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField())
+            )
         favorites = Favorites.objects.filter(user=user, recipe=OuterRef('pk'))
         shopping_cart = ShoppingCart.objects.filter(
             user=user, recipe=OuterRef('pk')
         )
-        queryset = Recipe.objects.select_related(
-            'author').prefetch_related('ingredients').annotate(
+        return queryset.annotate(
             is_favorited=Exists(favorites),
             is_in_shopping_cart=Exists(shopping_cart)
         )
-        return queryset
+
+    @cache_recipe_list
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        user = self.request.user
+        if user.is_authenticated:
+            # Авторы, на которых подписан пользователь, загружаются
+            # одним запросом на весь ответ.
+            context['subscriptions'] = set(
+                Subscriptions.objects.filter(user=user).values_list(
+                    'author_id', flat=True
+                )
+            )
+        return context
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
-    @action(detail=False, permission_classes=(IsAuthenticated,))
+    def perform_destroy(self, instance):
+        users = list(instance.baskets.values_list('user', flat=True))
+        ingredients = list(instance.ingredients.values_list('id', flat=True))
+        with transaction.atomic():
+            instance.delete()
+            ShoppingListItem.objects.refresh(users, ingredients)
+
+    # JSON первым: ошибки (401, пустая корзина) клиенту API отдаются
+    # в JSON, как раньше, а сам список при Accept: application/json
+    # или */* выгружается текстом.
+    @action(detail=False,
+            permission_classes=(IsAuthenticated,),
+            renderer_classes=(JSONRenderer, TextShoppingListRenderer,
+                              CSVShoppingListRenderer)
+            )
     def download_shopping_cart(self, request):
         if not ShoppingCart.objects.filter(
                 user=request.user
@@ -67,49 +149,246 @@ class RecipeViewSet(ModelViewSet):
                 {'errors': 'В Корзине отсутствуют рецепты'},
                 status=HTTP_400_BAD_REQUEST
             )
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__baskets__user=request.user
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user
         ).values(
+            'ingredient__name',
+            'ingredient__measurement_unit',
+            'amount'
+        ).order_by(
             'ingredient__name',
             'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-        shopping_list = ''
-        for ingredient in ingredients:
-            item = (f'* {ingredient["ingredient__name"]} '
-                    f'({ingredient["ingredient__measurement_unit"]}) -- '
-                    f'{ingredient["amount"]}\n\n'
-                    )
-            shopping_list += item
-        return HttpResponse(shopping_list,
-                            content_type='text/plain;charset=UTF-8'
-                            )
+        )
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, ShoppingListRenderer):
+            renderer = TextShoppingListRenderer()
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=f'{renderer.media_type};charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"'
+        )
+        return response
+
+    @action(detail=False)
+    def match(self, request):
+        """Рецепты, которые можно приготовить из переданных ингредиентов.
+
+        ?ingredients=1&ingredients=2 - имеющиеся ингредиенты,
+        min_coverage - минимальная доля ингредиентов рецепта среди них
+        (по умолчанию 0.5). Сначала рецепты с большим покрытием.
+        """
+        ingredients = request.query_params.getlist('ingredients')
+        if not ingredients or not all(
+            ingredient.isdigit() for ingredient in ingredients
+        ):
+            return Response(
+                {'errors': 'Передайте id ингредиентов в ingredients'},
+                status=HTTP_400_BAD_REQUEST
+            )
+        try:
+            min_coverage = float(
+                request.query_params.get('min_coverage', 0.5)
+            )
+        except ValueError:
+            min_coverage = -1
+        if not 0 <= min_coverage <= 1:
+            return Response(
+                {'errors': 'min_coverage должен быть от 0 до 1'},
+                status=HTTP_400_BAD_REQUEST
+            )
+        page = self.paginate_queryset(recipe_match_index.match(
+            map(int, ingredients), min_coverage
+        ))
+        recipes = self.get_queryset().in_bulk(
+            [recipe for recipe, _, _ in page]
+        )
+        results = []
+        for recipe_id, matched, total in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                continue
+            recipe.matched_ingredients = matched
+            recipe.total_ingredients = total
+            recipe.coverage = round(matched / total, 3)
+            results.append(recipe)
+        serializer = MatchedRecipeSerializer(
+            results, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True)
+    def similar(self, request, pk):
+        """Похожие рецепты, посчитанные командой buildsimilar.
+
+        Соседи читаются одним запросом по индексу (рецепт, близость);
+        ?limit= ограничивает их число.
+        """
+        limit = request.query_params.get('limit')
+        limit = int(limit) if limit and limit.isdigit() else None
+        recipes = self.get_queryset().filter(
+            similar_to__recipe_id=pk
+        ).order_by('-similar_to__score', '-id')[:limit]
+        serializer = self.get_serializer(recipes, many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, permission_classes=(IsAuthenticated,))
+    def recommended(self, request):
+        """Рекомендации по соседям рецептов из избранного и корзины.
+
+        Близость к каждому рецепту пользователя суммируется, рецепты,
+        которые у него уже есть, пропускаются.
+        """
+        user = request.user
+        seen = set(Favorites.objects.filter(user=user).values_list(
+            'recipe_id', flat=True
+        )) | set(ShoppingCart.objects.filter(user=user).values_list(
+            'recipe_id', flat=True
+        ))
+        scores = SimilarRecipe.objects.filter(recipe_id__in=seen).exclude(
+            similar_id__in=seen
+        ).values('similar_id').annotate(
+            total=Sum('score')
+        ).order_by('-total', '-similar_id').values_list(
+            'similar_id', flat=True
+        )[:settings.RECIPE_RECOMMEND_LIMIT]
+        page = self.paginate_queryset(list(scores) if seen else [])
+        recipes = self.get_queryset().in_bulk(page)
+        serializer = self.get_serializer(
+            [recipes[recipe] for recipe in page if recipe in recipes],
+            many=True
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        """Новые рецепты авторов из подписок пользователя.
+
+        Всегда отдаётся по курсору: ?cursor= - первая страница, next -
+        ссылка на следующую.
+        """
+        paginator = self.paginator
+        cursor = request.query_params.get(paginator.cursor_query_param, '')
+        if cursor and not cursor.isdigit():
+            raise NotFound(paginator.invalid_cursor_message)
+        limit = paginator.get_page_size(request)
+        page = read_feed(
+            request.user, int(cursor) if cursor else None, limit + 1
+        )
+        next_link = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_link = replace_query_param(
+                request.build_absolute_uri(),
+                paginator.cursor_query_param, page[-1]
+            )
+        recipes = self.get_queryset().in_bulk(page)
+        serializer = self.get_serializer(
+            [recipes[recipe] for recipe in page if recipe in recipes],
+            many=True
+        )
+        return Response(OrderedDict((
+            ('next', next_link), ('results', serializer.data)
+        )))
+
+    def add_recipe(self, model, recipe):
+        """Добавляет рецепт пользователю одним INSERT.
+
+        Повторный или параллельный запрос упирается в уникальность
+        пары пользователь-рецепт, ошибка ловится в точке сохранения.
+        """
+        try:
+            with transaction.atomic():
+                model.objects.create(user=self.request.user, recipe=recipe)
+        except IntegrityError:
+            return False
+        return True
+
+    def remove_recipe(self, model, pk):
+        """Удаляет рецепт у пользователя, возвращает, было ли что удалять."""
+        if not self.remove_recipes(model, (pk,)):
+            get_object_or_404(Recipe, id=pk)
+            return False
+        return True
+
+    def remove_recipes(self, model, recipe_ids):
+        """Удаляет рецепты и сбрасывает кэш, сигналов удаления нет."""
+        user = self.request.user
+        removed = model.objects.remove_recipes(user, recipe_ids)
+        if removed:
+            self.bump_versions(model, user)
+        return removed
+
+    def bump_versions(self, model, user):
+        bump_version_on_commit(f'user:{user.id}')
+        if model is Favorites:
+            bump_version_on_commit('popularity')
+
+    def change_recipes(self, model):
+        """Пакетно добавляет или удаляет рецепты из тела запроса.
+
+        Возвращает рецепты из запроса и id тех, что действительно
+        добавлены или удалены.
+        """
+        serializer = RecipeBatchSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        recipes = serializer.validated_data['recipes']
+        recipe_ids = [recipe.id for recipe in recipes]
+        if self.request.method == 'POST':
+            changed = model.objects.add_recipes(self.request.user, recipe_ids)
+            if changed:
+                self.bump_versions(model, self.request.user)
+        else:
+            changed = self.remove_recipes(model, recipe_ids)
+        return recipes, changed
 
     @action(methods=['post', 'delete'],
             detail=True,
             permission_classes=(IsAuthenticated,)
             )
     def shopping_cart(self, request, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
         if request.method == 'POST':
+            recipe = get_object_or_404(Recipe, id=pk)
+            with transaction.atomic():
+                if not self.add_recipe(ShoppingCart, recipe):
+                    return Response(
+                        {'errors': 'Этот рецепт уже есть в списке покупок'},
+                        status=HTTP_400_BAD_REQUEST
+                    )
+                ShoppingListItem.objects.refresh(
+                    (request.user.id,), recipe.ingredients.all()
+                )
             serializer = ShortRecipeSerializer(recipe)
-            if ShoppingCart.objects.filter(
-                user=request.user,
-                recipe=recipe
-            ).exists():
+            return Response(serializer.data, status=HTTP_201_CREATED)
+
+        with transaction.atomic():
+            if not self.remove_recipe(ShoppingCart, pk):
                 return Response(
-                    {'errors': 'Этот рецепт уже есть в списке покупок'},
+                    {'errors': 'Этого рецепта нет в списке покупок'},
                     status=HTTP_400_BAD_REQUEST
                 )
-            ShoppingCart.objects.create(
-                user=request.user,
-                recipe=recipe
+            ShoppingListItem.objects.refresh(
+                (request.user.id,), Ingredient.objects.filter(recipes=pk)
             )
-            return Response(serializer.data, status=HTTP_201_CREATED)
+        return Response(status=HTTP_204_NO_CONTENT)
 
-        ShoppingCart.objects.filter(
-            user=request.user,
-            recipe=recipe
-        ).delete()
+    @action(methods=['post', 'delete'],
+            detail=False,
+            url_path='shopping_cart',
+            permission_classes=(IsAuthenticated,)
+            )
+    def shopping_cart_batch(self, request):
+        with transaction.atomic():
+            recipes, changed = self.change_recipes(ShoppingCart)
+            if changed:
+                ShoppingListItem.objects.refresh(
+                    (request.user.id,),
+                    Ingredient.objects.filter(recipes__in=changed)
+                )
+        if request.method == 'POST':
+            serializer = ShortRecipeSerializer(recipes, many=True)
+            return Response(serializer.data, status=HTTP_201_CREATED)
         return Response(status=HTTP_204_NO_CONTENT)
 
     @action(methods=['post', 'delete'],
@@ -117,25 +396,31 @@ class RecipeViewSet(ModelViewSet):
             permission_classes=(IsAuthenticated,)
             )
     def favorite(self, request, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
         if request.method == 'POST':
-            serializer = ShortRecipeSerializer(recipe)
-            if Favorites.objects.filter(
-                user=request.user,
-                recipe=recipe
-            ).exists():
+            recipe = get_object_or_404(Recipe, id=pk)
+            if not self.add_recipe(Favorites, recipe):
                 return Response(
                     {'errors': 'Этот рецепт уже есть в Избранном'},
                     status=HTTP_400_BAD_REQUEST
                 )
-            Favorites.objects.create(
-                user=request.user,
-                recipe=recipe
-            )
+            serializer = ShortRecipeSerializer(recipe)
             return Response(serializer.data, status=HTTP_201_CREATED)
 
-        Favorites.objects.filter(
-            user=request.user,
-            recipe=recipe
-        ).delete()
+        if not self.remove_recipe(Favorites, pk):
+            return Response(
+                {'errors': 'Этого рецепта нет в Избранном'},
+                status=HTTP_400_BAD_REQUEST
+            )
+        return Response(status=HTTP_204_NO_CONTENT)
+
+    @action(methods=['post', 'delete'],
+            detail=False,
+            url_path='favorite',
+            permission_classes=(IsAuthenticated,)
+            )
+    def favorite_batch(self, request):
+        recipes, _ = self.change_recipes(Favorites)
+        if request.method == 'POST':
+            serializer = ShortRecipeSerializer(recipes, many=True)
+            return Response(serializer.data, status=HTTP_201_CREATED)
         return Response(status=HTTP_204_NO_CONTENT)
@@ -0,0 +1,3 @@
+# Проверка соединений с БД относится к настройкам DATABASES и должна
+# работать с любым DB_ENGINE, поэтому подключается вместе с проектом.
+from . import db  # noqa: F401
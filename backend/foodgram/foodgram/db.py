@@ -0,0 +1,18 @@
+from django.core.signals import request_started
+from django.db import connections
+from django.dispatch import receiver
+
+
+@receiver(request_started)
+def check_database_connections(sender, **kwargs):
+    """Закрывает оставшиеся от прошлого запроса разорванные соединения.
+
+    Аналог CONN_HEALTH_CHECKS из новых версий Django: при CONN_MAX_AGE
+    больше 0 соединение, разорванное базой или сетью, иначе дало бы
+    ошибку в первом запросе к БД.
+    """
+    for connection in connections.all():
+        if (connection.settings_dict.get('CONN_HEALTH_CHECKS')
+                and connection.connection is not None
+                and not connection.is_usable()):
+            connection.close()
@@ -0,0 +1,57 @@
+import threading
+
+from django.db.backends.postgresql import base
+
+from .pool import ConnectionPool
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL с пулом соединений процесса.
+
+    Вместо открытия соединения берётся свободное из пула, вместо
+    закрытия соединение возвращается в пул. Размер и ожидание
+    задаются в DATABASES[...]['POOL'], CONN_MAX_AGE стоит оставить 0:
+    тогда соединение занято только на время запроса.
+    """
+    @property
+    def pool_key(self):
+        # Служебные соединения к базе postgres (создание тестовой базы)
+        # не должны попадать в пул основной базы.
+        return self.alias, self.settings_dict['NAME']
+
+    @property
+    def pool(self):
+        return pools.get(self.pool_key)
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            with pools_lock:
+                pool = pools.get(self.pool_key)
+                if pool is None:
+                    options = self.settings_dict.get('POOL', {})
+                    pool = pools[self.pool_key] = ConnectionPool(
+                        self.alias,
+                        options.get('MAX_SIZE', 10),
+                        options.get('TIMEOUT', 10),
+                        self.settings_dict.get('CONN_HEALTH_CHECKS', False),
+                        options.get('STATS_FLUSH_INTERVAL', 10)
+                    )
+        return pool.getconn(
+            lambda: super(DatabaseWrapper, self).get_new_connection(
+                conn_params
+            )
+        )
+
+    def _close(self):
+        if self.connection is None:
+            return
+        # Закрытое внутри atomic соединение остаётся у обёртки до выхода
+        # из блока, поэтому в пул оно не возвращается.
+        with self.wrap_database_errors:
+            self.pool.putconn(
+                self.connection, discard=self.in_atomic_block
+            )
@@ -0,0 +1,178 @@
+import os
+import socket
+import threading
+from collections import Counter
+from math import ceil
+from time import monotonic
+
+from django.core.cache import cache
+from django.db.utils import OperationalError
+
+FIELDS = ('opened', 'closed', 'checkouts', 'checkins', 'timeouts',
+          'health_check_failures', 'wait_us')
+GAUGES = ('size', 'in_use', 'idle')
+# Снимок процесса живёт в кэше столько сбросов: снимки завершённых
+# процессов истекают и не попадают в сумму.
+GAUGE_TTL_FLUSHES = 3
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """Пул соединений с базой, общий для потоков процесса.
+
+    Не больше max_size соединений открыто одновременно; поток, которому
+    не хватило соединения, ждёт не дольше timeout секунд. Раз в
+    flush_interval секунд счётчики складываются в кэш, как статистика
+    запросов (команда requeststats), а текущие размеры пула процесса
+    записываются в кэш отдельным снимком с ограниченным временем жизни.
+    """
+    def __init__(self, alias, max_size, timeout, health_checks=False,
+                 flush_interval=10):
+        self.alias = alias
+        self.timeout = timeout
+        self.health_checks = health_checks
+        self.flush_interval = flush_interval
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._stats = Counter()
+        self._flushed_at = monotonic()
+        self.totals = Counter()
+
+    def getconn(self, connect):
+        """Свободное соединение из пула или новое через connect()."""
+        started = monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            self.count(timeouts=1)
+            raise PoolTimeout(
+                f'Нет свободного соединения с базой {self.alias} '
+                f'за {self.timeout} с'
+            )
+        try:
+            connection = self.take_idle()
+            if connection is None:
+                connection = connect()
+                self.count(opened=1)
+        except Exception:
+            self._slots.release()
+            raise
+        self.count(
+            checkouts=1, wait_us=int((monotonic() - started) * 10 ** 6)
+        )
+        return connection
+
+    def take_idle(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                connection = self._idle.pop()
+            if not connection.closed and (
+                not self.health_checks or self.is_usable(connection)
+            ):
+                return connection
+            self.discard(connection)
+
+    def is_usable(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except Exception:
+            self.count(health_check_failures=1)
+            return False
+        return True
+
+    def putconn(self, connection, discard=False):
+        """Возвращает соединение в пул, откатив незавершённую транзакцию.
+
+        С discard=True соединение закрывается, а место в пуле
+        освобождается.
+        """
+        try:
+            if not discard and not connection.closed:
+                connection.rollback()
+        except Exception:
+            self.discard(connection)
+        else:
+            if discard or connection.closed:
+                self.discard(connection)
+            else:
+                with self._lock:
+                    self._idle.append(connection)
+        self._slots.release()
+        self.count(checkins=1)
+
+    def discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        self.count(closed=1)
+
+    def gauges(self):
+        """Текущие размеры пула процесса (вызывается под _lock)."""
+        size = self.totals['opened'] - self.totals['closed']
+        idle = len(self._idle)
+        return {'size': size, 'in_use': size - idle, 'idle': idle}
+
+    def count(self, **fields):
+        with self._lock:
+            self._stats.update(fields)
+            self.totals.update(fields)
+            if monotonic() - self._flushed_at < self.flush_interval:
+                return
+            stats, self._stats = self._stats, Counter()
+            gauges = self.gauges()
+            self._flushed_at = monotonic()
+        flush_stats(self.alias, stats)
+        # Процесс определяется при сбросе: пул мог быть создан до fork.
+        flush_gauges(
+            self.alias, f'{socket.gethostname()}:{os.getpid()}', gauges,
+            max(ceil(self.flush_interval * GAUGE_TTL_FLUSHES), 1)
+        )
+
+
+def flush_stats(alias, stats):
+    for field, value in stats.items():
+        key = f'dbpool:{alias}:{field}'
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            pass
+
+
+def flush_gauges(alias, process, gauges, timeout):
+    """Записывает снимок процесса и добавляет процесс в список пула."""
+    cache.set(f'dbpool:{alias}:gauges:{process}', gauges, timeout)
+    key = f'dbpool:{alias}:processes'
+    processes = cache.get(key, set())
+    if process not in processes:
+        cache.set(key, processes | {process}, None)
+
+
+def read_pool_stats(alias='default'):
+    """Счётчики пула и сумма свежих снимков размеров по процессам."""
+    values = cache.get_many([f'dbpool:{alias}:{field}' for field in FIELDS])
+    stats = {
+        field: values.get(f'dbpool:{alias}:{field}', 0) for field in FIELDS
+    }
+    key = f'dbpool:{alias}:processes'
+    processes = cache.get(key, set())
+    keys = {
+        f'dbpool:{alias}:gauges:{process}': process for process in processes
+    }
+    snapshots = cache.get_many(keys)
+    for gauge in GAUGES:
+        stats[gauge] = sum(
+            snapshot[gauge] for snapshot in snapshots.values()
+        )
+    stats['processes'] = len(snapshots)
+    # Процессы с истёкшим снимком убираются из списка, живые
+    # добавят себя снова при следующем сбросе.
+    if len(snapshots) < len(processes):
+        cache.set(key, {keys[gauge_key] for gauge_key in snapshots}, None)
+    return stats
@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,10 +89,75 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
-        'PORT': os.getenv('DB_PORT')
+        'PORT': os.getenv('DB_PORT'),
+        # Соединение живёт между запросами столько секунд,
+        # 0 - закрывается после каждого запроса.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 0)),
+        # Проверять SELECT 1 соединение, оставшееся от прошлого запроса
+        # или взятое из пула, перед использованием.
+        'CONN_HEALTH_CHECKS': (
+            os.getenv('DB_CONN_HEALTH_CHECKS', 'False') == 'True'
+        ),
+        # Пул соединений процесса для DB_ENGINE=foodgram.postgresql_pool:
+        # потоки воркера берут соединение на время запроса и ждут
+        # свободного не дольше TIMEOUT секунд. Раз в STATS_FLUSH_INTERVAL
+        # секунд процесс пишет счётчики и размеры пула в кэш.
+        'POOL': {
+            'MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+            'STATS_FLUSH_INTERVAL': float(
+                os.getenv('DB_POOL_STATS_FLUSH_INTERVAL', 10)
+            ),
+        },
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Сколько секунд живут закэшированные ответы справочников (теги,
+# ингредиенты). С общим кэшем (Redis) изменения видны сразу, с locmem
+# другие процессы увидят их не позже чем через это время.
+REFERENCE_CACHE_TIMEOUT = int(os.getenv('REFERENCE_CACHE_TIMEOUT', 300))
+# Сколько секунд живёт кэш списка рецептов, 0 - кэш выключен.
+# Включать только с общим для всех процессов кэшем: поколения данных
+# пользователя с locmem в соседних процессах не сбрасываются.
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', 0))
+
+# Учёт запросов к БД и времени ответа (заголовок Server-Timing, лог
+# api.requests, сводка по вьюхам - команда requeststats).
+REQUEST_STATS_ENABLED = os.getenv('REQUEST_STATS_ENABLED', 'True') == 'True'
+# Сколько раз один SQL может повториться за запрос, прежде чем
+# в лог попадёт предупреждение о вероятном N+1.
+REQUEST_STATS_DUPLICATE_THRESHOLD = int(
+    os.getenv('REQUEST_STATS_DUPLICATE_THRESHOLD', 5)
+)
+# Как часто (в секундах) процесс сбрасывает свою сводку в кэш.
+REQUEST_STATS_FLUSH_INTERVAL = 10
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # INFO - строка на каждый запрос, WARNING - только N+1.
+        'api.requests': {
+            'handlers': ['console'],
+            'level': os.getenv('REQUEST_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -137,6 +203,16 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Уменьшенные копии картинок рецептов: имя -> максимальные размеры.
+# Копии создаются в фоне пулом из RECIPE_IMAGE_WORKERS потоков.
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': (320, 320),
+    'card': (640, 640),
+    'full': (1280, 1280),
+}
+RECIPE_IMAGE_FORMAT = os.getenv('RECIPE_IMAGE_FORMAT', 'WEBP')
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+
 AUTH_USER_MODEL = 'users.User'
 
 
@@ -165,3 +241,37 @@ DJOSER = {
         'user_list': ['rest_framework.permissions.IsAuthenticatedOrReadOnly'],
     }
 }
+
+# Поиск ингредиентов по названию идёт по индексу в памяти процесса,
+# при INGREDIENT_INDEX_ENABLED = False - запросом к базе данных.
+INGREDIENT_INDEX_ENABLED = True
+# Через сколько секунд индекс перестраивается, даже если в этом
+# процессе ингредиенты не менялись.
+INGREDIENT_INDEX_TTL = 300
+
+# Поиск рецептов (?search=) идёт по полнотекстовому индексу PostgreSQL,
+# на других базах - по индексу в памяти процесса, который
+# перестраивается не реже чем раз в RECIPE_SEARCH_INDEX_TTL секунд
+# и отдаёт не больше RECIPE_SEARCH_LIMIT лучших рецептов.
+RECIPE_SEARCH_INDEX_TTL = 300
+RECIPE_SEARCH_LIMIT = 300
+
+# Подбор рецептов по имеющимся ингредиентам идёт по индексу в памяти
+# процесса; изменения из других процессов он увидит через столько секунд.
+RECIPE_MATCH_INDEX_TTL = 300
+
+# Похожие рецепты считает команда buildsimilar и хранит для каждого
+# рецепта столько соседей; рекомендации пользователю собираются
+# из соседей его рецептов, не больше RECIPE_RECOMMEND_LIMIT.
+RECIPE_SIMILAR_TOP_K = 20
+RECIPE_RECOMMEND_LIMIT = 100
+
+# Лента подписок: новый рецепт раскладывается по лентам подписчиков,
+# в каждой хранится не больше FEED_MAX_ITEMS рецептов (лента обрезается,
+# когда перерастает лимит на FEED_TRIM_SLACK). Рецепты авторов
+# с FEED_FANOUT_LIMIT и более подписчиками читаются при запросе ленты,
+# список таких авторов обновляется раз в FEED_POPULAR_AUTHORS_TIMEOUT с.
+FEED_MAX_ITEMS = 500
+FEED_TRIM_SLACK = 50
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 1000))
+FEED_POPULAR_AUTHORS_TIMEOUT = 300
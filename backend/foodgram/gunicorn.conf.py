@@ -0,0 +1,24 @@
+import multiprocessing
+import os
+
+# Потоковые воркеры: пока один поток ждёт ответа БД, другие
+# обрабатывают запросы. Django 2.2 не умеет ASGI и асинхронный ORM,
+# поэтому параллельность внутри воркера даёт пул потоков.
+bind = '0:8000'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_class = 'gthread' if threads > 1 else 'sync'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+
+# Каждый поток держит своё соединение с БД (с пулом - не больше
+# DB_POOL_MAX_SIZE на процесс), поэтому число процессов по умолчанию
+# ограничено долей max_connections PostgreSQL, отданной приложению:
+# DB_MAX_CONNECTIONS, по умолчанию 50 из стандартных 100.
+connections_per_worker = threads
+if os.getenv('DB_ENGINE') == 'foodgram.postgresql_pool':
+    connections_per_worker = min(
+        threads, int(os.getenv('DB_POOL_MAX_SIZE', 10))
+    )
+workers = int(os.getenv('GUNICORN_WORKERS', max(1, min(
+    multiprocessing.cpu_count() * 2 + 1,
+    int(os.getenv('DB_MAX_CONNECTIONS', 50)) // connections_per_worker
+))))
@@ -2,7 +2,8 @@ from django.contrib import admin
 from django.contrib.admin import ModelAdmin
 
 from .models import (Favorites, Ingredient, Recipe, RecipeIngredient,
-                     RecipeTag, ShoppingCart, Tag)
+                     RecipeTag, ShoppingCart, ShoppingListItem, SimilarRecipe,
+                     Tag)
 
 
 class IngredientAdmin(ModelAdmin):
@@ -11,12 +12,9 @@ class IngredientAdmin(ModelAdmin):
 
 
 class RecipeAdmin(ModelAdmin):
-    list_display = ('name', 'author', 'count_favorites')
+    list_display = ('name', 'author', 'favorites_count', 'cart_count')
     list_filter = ('author', 'name', 'tags')
 
-    def count_favorites(self, obj):
-        return obj.favorites.count()
-
 
 admin.site.register(Tag)
 admin.site.register(Ingredient, IngredientAdmin)
@@ -25,3 +23,5 @@ admin.site.register(Favorites)
 admin.site.register(ShoppingCart)
 admin.site.register(RecipeIngredient)
 admin.site.register(RecipeTag)
+admin.site.register(ShoppingListItem)
+admin.site.register(SimilarRecipe)
@@ -0,0 +1,49 @@
+from bisect import bisect_left
+from itertools import chain
+
+from .indexes import ProcessIndex
+from .models import Ingredient
+
+
+class IngredientIndex(ProcessIndex):
+    """Индекс названий ингредиентов для автодополнения.
+
+    Названия хранятся в отсортированном списке: совпадения по началу
+    строки находятся бинарным поиском, совпадения по подстроке идут
+    следом. Индекс строится при первом поиске и перестраивается после
+    изменения ингредиентов или по истечении INGREDIENT_INDEX_TTL секунд.
+    """
+    ttl_setting = 'INGREDIENT_INDEX_TTL'
+
+    def __init__(self):
+        super().__init__()
+        self._index = None
+
+    def build(self):
+        items = sorted(
+            (
+                {'id': pk, 'name': name, 'measurement_unit': unit}
+                for pk, name, unit in Ingredient.objects.values_list(
+                    'id', 'name', 'measurement_unit'
+                )
+            ),
+            key=lambda item: (item['name'].lower(), item['id'])
+        )
+        self._index = ([item['name'].lower() for item in items], items)
+
+    def search(self, query, limit=None):
+        self.ensure_built()
+        names, items = self._index
+        query = query.lower()
+        start = bisect_left(names, query)
+        end = bisect_left(names, query + '\U0010ffff', start)
+        result = items[start:end]
+        for position in chain(range(start), range(end, len(names))):
+            if limit is not None and len(result) >= limit:
+                break
+            if query in names[position]:
+                result.append(items[position])
+        return result[:limit]
+
+
+ingredient_index = IngredientIndex()
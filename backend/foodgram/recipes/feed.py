@@ -0,0 +1,124 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from users.models import Subscriptions
+
+from .models import FeedItem, Recipe
+
+POPULAR_AUTHORS_KEY = 'feed:popular-authors'
+
+
+def popular_authors():
+    """Авторы, у которых не меньше FEED_FANOUT_LIMIT подписчиков.
+
+    Их рецепты не раскладываются по лентам, а читаются при запросе.
+    Список пересчитывается раз в FEED_POPULAR_AUTHORS_TIMEOUT секунд.
+    """
+    def load():
+        return frozenset(Subscriptions.objects.values('author').annotate(
+            followers=Count('id')
+        ).filter(
+            followers__gte=settings.FEED_FANOUT_LIMIT
+        ).values_list('author', flat=True))
+    return cache.get_or_set(
+        POPULAR_AUTHORS_KEY, load, settings.FEED_POPULAR_AUTHORS_TIMEOUT
+    )
+
+
+def trim_feeds(users=None, slack=None):
+    """Обрезает ленты до FEED_MAX_ITEMS новых рецептов (все, если None).
+
+    Лента обрезается, только когда переросла лимит больше чем на slack
+    (FEED_TRIM_SLACK): переполненные ленты находятся одним запросом с
+    GROUP BY, для каждой граница считается один раз, а каждая лента
+    обрезается раз в slack новых рецептов, а не при каждом.
+    """
+    limit = settings.FEED_MAX_ITEMS
+    if slack is None:
+        slack = settings.FEED_TRIM_SLACK
+    items = FeedItem.objects.all()
+    if users is not None:
+        items = items.filter(user_id__in=users)
+    overflowing = items.values('user').annotate(
+        size=Count('id')
+    ).filter(size__gt=limit + slack).values_list('user', flat=True)
+    condition = Q()
+    for user in overflowing:
+        oldest_kept = FeedItem.objects.filter(user=user).order_by(
+            '-recipe_id'
+        ).values_list('recipe_id', flat=True)[limit - 1]
+        condition |= Q(user=user, recipe_id__lt=oldest_kept)
+    if condition:
+        FeedItem.objects.filter(condition).delete()
+
+
+def push_recipe(recipe):
+    """Кладёт новый рецепт в ленты подписчиков автора.
+
+    Вставка - один запрос на любое число подписчиков.
+    """
+    if recipe.author_id in popular_authors():
+        return
+    followers = list(Subscriptions.objects.filter(
+        author_id=recipe.author_id
+    ).values_list('user_id', flat=True))
+    if not followers:
+        return
+    FeedItem.objects.bulk_create(
+        (FeedItem(user_id=user, recipe_id=recipe.id) for user in followers),
+        ignore_conflicts=True
+    )
+    trim_feeds(followers)
+
+
+def follow(user_id, author_id):
+    """Добавляет в ленту последние рецепты нового автора."""
+    if author_id in popular_authors():
+        return
+    recipes = Recipe.objects.filter(author_id=author_id).order_by(
+        '-id'
+    ).values_list('id', flat=True)[:settings.FEED_MAX_ITEMS]
+    FeedItem.objects.bulk_create(
+        (FeedItem(user_id=user_id, recipe_id=recipe) for recipe in recipes),
+        ignore_conflicts=True
+    )
+    trim_feeds((user_id,))
+
+
+def unfollow(user_id, author_id):
+    FeedItem.objects.filter(
+        user_id=user_id, recipe__author_id=author_id
+    ).delete()
+
+
+def read_feed(user, before=None, limit=None):
+    """id рецептов ленты по убыванию, не старше before (не включая).
+
+    Разложенные по ленте рецепты читаются по индексу ленты
+    пользователя, рецепты популярных авторов из его подписок - по
+    индексу (автор, id). Время не зависит от числа подписок.
+    """
+    pushed = FeedItem.objects.filter(user=user)
+    if before is not None:
+        pushed = pushed.filter(recipe_id__lt=before)
+    recipes = list(pushed.order_by('-recipe_id').values_list(
+        'recipe_id', flat=True
+    )[:limit])
+    popular = popular_authors()
+    if not popular:
+        return recipes
+    authors = list(Subscriptions.objects.filter(
+        user=user, author_id__in=popular
+    ).values_list('author_id', flat=True))
+    if not authors:
+        return recipes
+    pulled = Recipe.objects.filter(author_id__in=authors)
+    if before is not None:
+        pulled = pulled.filter(id__lt=before)
+    # Автор мог стать популярным, когда часть его рецептов уже
+    # лежала в лентах: повторы убираются при слиянии.
+    recipes = set(recipes)
+    recipes.update(pulled.order_by('-id').values_list(
+        'id', flat=True
+    )[:limit])
+    return sorted(recipes, reverse=True)[:limit]
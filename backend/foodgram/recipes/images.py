@@ -0,0 +1,86 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+executor = ThreadPoolExecutor(
+    max_workers=settings.RECIPE_IMAGE_WORKERS,
+    thread_name_prefix='recipe-images'
+)
+
+
+def variant_name(name, variant):
+    """Путь к уменьшенной копии картинки рецепта."""
+    directory, filename = os.path.split(name)
+    root = os.path.splitext(filename)[0]
+    extension = settings.RECIPE_IMAGE_FORMAT.lower()
+    return os.path.join(directory, 'variants', f'{root}_{variant}.{extension}')
+
+
+def make_variants(recipe_id, name):
+    """Создаёт уменьшенные копии картинки и отмечает рецепт готовым.
+
+    Если пока шла обработка у рецепта сменилась картинка, отметка
+    не ставится: копии для новой картинки сделает её собственная задача.
+    """
+    try:
+        with default_storage.open(name) as original:
+            image = Image.open(original)
+            image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        if settings.RECIPE_IMAGE_FORMAT == 'JPEG':
+            image = image.convert('RGB')
+        for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail(size)
+            buffer = BytesIO()
+            resized.save(buffer, settings.RECIPE_IMAGE_FORMAT, quality=80)
+            path = variant_name(name, variant)
+            default_storage.delete(path)
+            default_storage.save(path, ContentFile(buffer.getvalue()))
+        recipe = Recipe.objects.filter(id=recipe_id, image=name).first()
+        if recipe is not None:
+            recipe.image_variants_ready = True
+            recipe.save(update_fields=('image_variants_ready',))
+    except Exception:
+        logger.exception('Не удалось обработать картинку %s', name)
+
+
+def make_variants_in_worker(recipe_id, name):
+    """Обработка в потоке пула: соединение с БД потока закрывается."""
+    try:
+        make_variants(recipe_id, name)
+    finally:
+        connection.close()
+
+
+def schedule_variants(recipe):
+    """Ставит обработку картинки в очередь после фиксации транзакции."""
+    recipe_id, name = recipe.id, recipe.image.name
+    transaction.on_commit(
+        lambda: executor.submit(make_variants_in_worker, recipe_id, name)
+    )
+
+
+def variant_urls(recipe, request=None):
+    """Ссылки на копии картинки, пока их нет - на оригинал."""
+    if not recipe.image:
+        return None
+    urls = {}
+    for variant in settings.RECIPE_IMAGE_VARIANTS:
+        if recipe.image_variants_ready:
+            url = default_storage.url(variant_name(recipe.image.name, variant))
+        else:
+            url = recipe.image.url
+        urls[variant] = request.build_absolute_uri(url) if request else url
+    return urls
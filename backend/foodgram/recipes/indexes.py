@@ -0,0 +1,48 @@
+import threading
+from time import monotonic
+
+from django.conf import settings
+from django.db import transaction
+
+
+class ProcessIndex:
+    """Индекс в памяти процесса, который строится по данным базы.
+
+    Строится при первом обращении и перестраивается после
+    invalidate() или по истечении настройки ttl_setting (в секундах).
+    Сброс откладывается до фиксации транзакции: иначе параллельный
+    запрос успел бы перестроить индекс по ещё не зафиксированным
+    данным и считал бы его свежим.
+
+    Потоки воркера строят и меняют индекс по очереди под _lock, а build()
+    собирает новые объекты и подменяет их одним присваиванием, так что
+    поиск без блокировки видит либо старый индекс, либо новый целиком.
+    """
+    ttl_setting = None
+
+    def __init__(self):
+        self._built_at = None
+        self._lock = threading.Lock()
+
+    def build(self):
+        raise NotImplementedError
+
+    def invalidate(self):
+        transaction.on_commit(self.reset)
+
+    def reset(self):
+        with self._lock:
+            self._built_at = None
+
+    def is_fresh(self):
+        return (self._built_at is not None
+                and monotonic() - self._built_at
+                <= getattr(settings, self.ttl_setting))
+
+    def ensure_built(self):
+        if self.is_fresh():
+            return
+        with self._lock:
+            if not self.is_fresh():
+                self.build()
+                self._built_at = monotonic()
@@ -0,0 +1,135 @@
+import multiprocessing
+import os
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from recipes import similarity
+from recipes.models import SimilarRecipe, SimilaritySignature
+
+
+class Command(BaseCommand):
+    """Команда расчёта похожих рецептов по избранному и корзинам.
+
+    У каждого рецепта хранится отпечаток его пользователей и
+    параметров расчёта. Рецепт изменился, если отпечаток другой; по
+    умолчанию пересчитываются изменившиеся рецепты, рецепты с общими
+    с ними пользователями и рецепты, у которых они были в соседях.
+    С другими --top-k, --min-common или --max-user-items меняются все
+    отпечатки, и пересчёт получается полным, как с --full.
+    Рецепты делятся на пачки, пачки считаются в --workers процессах.
+    Отпечатки записываются после всех пачек, поэтому прерванный
+    запуск повторяется целиком.
+    """
+    help = 'building top-K similar recipes from co-favorites'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int,
+                            default=settings.RECIPE_SIMILAR_TOP_K)
+        parser.add_argument('--min-common', default=2, type=int,
+                            help='минимум общих пользователей у пары')
+        parser.add_argument('--max-user-items', default=1000, type=int,
+                            help='пропускать пользователей с большим '
+                                 'числом рецептов, 0 - не пропускать')
+        parser.add_argument('--workers', default=os.cpu_count(), type=int)
+        parser.add_argument('--chunk-size', default=500, type=int)
+        parser.add_argument('--full', action='store_true')
+
+    def handle(self, *args, **options):
+        matrix = similarity.CoFavoriteMatrix(options['max_user_items'])
+        params = (options['top_k'], options['min_common'],
+                  options['max_user_items'])
+        signatures = {
+            recipe: hash((params, tuple(sorted(column.items()))))
+            for recipe, column in matrix.recipes.items()
+        }
+        stored = dict(SimilaritySignature.objects.values_list(
+            'recipe_id', 'signature'
+        ))
+        changed = {
+            recipe for recipe in signatures.keys() | stored.keys()
+            if signatures.get(recipe) != stored.get(recipe)
+        }
+        if options['full']:
+            recipes = set(signatures)
+        else:
+            recipes = self.affected(matrix, changed)
+        SimilarRecipe.objects.filter(
+            recipe_id__in=stored.keys() - signatures.keys()
+        ).delete()
+        # У рецепта, который добавили меньше min_common пользователей,
+        # соседей быть не может: его строки просто удаляются.
+        recipes = sorted(
+            recipe for recipe in recipes
+            if len(matrix.recipes.get(recipe, ())) >= options['min_common']
+        )
+        SimilarRecipe.objects.filter(
+            recipe_id__in=changed - set(recipes)
+        ).delete()
+        chunks = [
+            recipes[start:start + options['chunk_size']]
+            for start in range(0, len(recipes), options['chunk_size'])
+        ]
+        compute = partial(
+            similarity.neighbours_chunk,
+            top_k=options['top_k'], min_common=options['min_common']
+        )
+        similarity.matrix = matrix
+        done = 0
+        if options['workers'] > 1 and len(chunks) > 1:
+            # Воркеры получают матрицу через fork; соединение с базой
+            # закрывается, чтобы они не унаследовали открытый сокет.
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(
+                options['workers']
+            ) as pool:
+                for results in pool.imap_unordered(compute, chunks):
+                    done += self.save(results)
+        else:
+            for chunk in chunks:
+                done += self.save(compute(chunk))
+        similarity.matrix = None
+        with transaction.atomic():
+            SimilaritySignature.objects.filter(recipe_id__in=changed).delete()
+            SimilaritySignature.objects.bulk_create(
+                SimilaritySignature(recipe_id=recipe,
+                                    signature=signatures[recipe])
+                for recipe in changed if recipe in signatures
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Изменилось рецептов: {len(changed)}, '
+            f'пересчитано: {len(recipes)}, пар: {done}'
+        ))
+
+    def affected(self, matrix, changed):
+        """Рецепты, у которых могли поменяться соседи.
+
+        Близость пары зависит от обоих столбцов матрицы, так что кроме
+        самих изменившихся рецептов нужны все, у кого с ними есть общий
+        пользователь, и все, у кого они уже записаны соседями.
+        """
+        recipes = set(changed)
+        for recipe in changed:
+            for user in matrix.recipes.get(recipe, ()):
+                recipes.update(matrix.users[user])
+        recipes.update(SimilarRecipe.objects.filter(
+            similar_id__in=changed
+        ).values_list('recipe_id', flat=True))
+        return recipes
+
+    def save(self, results):
+        rows = [
+            SimilarRecipe(recipe_id=recipe, similar_id=other,
+                          score=round(score, 6))
+            for recipe, neighbours in results
+            for score, other in neighbours
+        ]
+        with transaction.atomic():
+            SimilarRecipe.objects.filter(
+                recipe_id__in=[recipe for recipe, _ in results]
+            ).delete()
+            SimilarRecipe.objects.bulk_create(rows)
+        self.stdout.write(f'Записано соседей: {len(rows)}')
+        return len(rows)
@@ -1,34 +1,115 @@
 import csv
+import io
+import json
 import os
+from itertools import islice
+from time import monotonic
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
+from api.cache import bump_version
 from recipes.models import Ingredient
 
 
 class Command(BaseCommand):
-    """Класс команды загрузки базы данных."""
-    help = 'loading ingredients from data in json or csv'
+    """Класс команды загрузки базы данных.
+
+    CSV и JSON Lines (.jsonl, объект на строку) читаются построчно.
+    Файл .json - один массив, он разбирается в память целиком, поэтому
+    большие списки лучше загружать из CSV или JSON Lines.
+    """
+    help = ('loading ingredients from data in csv, jsonl (streamed) '
+            'or json (read into memory whole)')
 
     def add_arguments(self, parser):
         parser.add_argument('filename', default='ingredients.csv', nargs='?',
                             type=str)
+        parser.add_argument('--batch-size', default=5000, type=int)
 
     def handle(self, *args, **options):
+        path = os.path.join(settings.BASE_DIR, 'data', options['filename'])
+        if path.endswith('.jsonl'):
+            read = self.read_json_lines
+        elif path.endswith('.json'):
+            read = self.read_json
+        else:
+            read = self.read_csv
+        write = (self.write_copy if connection.vendor == 'postgresql'
+                 else self.write_bulk)
+        count_before = Ingredient.objects.count()
+        processed = 0
+        seen = set()
+        started = monotonic()
         try:
-            with open(os.path.join(
-                    settings.BASE_DIR,
-                    'data',
-                    options['filename']),
-                    'r',
-                    encoding='utf-8') as f:
-                data = csv.reader(f)
-                for row in data:
-                    name, measurement_unit = row
-                    Ingredient.objects.get_or_create(
-                        name=name,
-                        measurement_unit=measurement_unit
-                    )
+            with open(path, 'r', encoding='utf-8') as f:
+                rows = read(f)
+                while True:
+                    chunk = list(islice(rows, options['batch_size']))
+                    if not chunk:
+                        break
+                    processed += len(chunk)
+                    chunk = set(chunk) - seen
+                    seen.update(chunk)
+                    with transaction.atomic():
+                        write(chunk)
+                    self.stdout.write(f'Обработано строк: {processed}')
         except FileNotFoundError:
             raise CommandError('Добавьте файл ingredients в папку data')
+        # bulk_create и COPY не отправляют сигналы, версию кэша
+        # справочника нужно сбросить явно.
+        bump_version('ingredients', settings.REFERENCE_CACHE_TIMEOUT)
+        bump_version('recipes')
+        elapsed = monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Добавлено ингредиентов: '
+            f'{Ingredient.objects.count() - count_before} '
+            f'из {processed} строк за {elapsed:.2f} с '
+            f'({processed / max(elapsed, 1e-6):.0f} строк/с)'
+        ))
+
+    def read_csv(self, f):
+        for row in csv.reader(f):
+            if row:
+                name, measurement_unit = row
+                yield name.strip(), measurement_unit.strip()
+
+    def read_json(self, f):
+        for item in json.load(f):
+            yield item['name'].strip(), item['measurement_unit'].strip()
+
+    def read_json_lines(self, f):
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                yield item['name'].strip(), item['measurement_unit'].strip()
+
+    def write_bulk(self, rows):
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=name, measurement_unit=measurement_unit)
+             for name, measurement_unit in rows),
+            ignore_conflicts=True
+        )
+
+    def write_copy(self, rows):
+        """Загрузка через COPY во временную таблицу и INSERT без дублей."""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredients_import '
+                '(name varchar(200), measurement_unit varchar(200)) '
+                'ON COMMIT DROP'
+            )
+            cursor.copy_expert(
+                'COPY ingredients_import FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT name, measurement_unit FROM ingredients_import '
+                'ON CONFLICT DO NOTHING'
+            )
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import make_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Команда создания уменьшенных копий картинок рецептов."""
+    help = 'making resized image variants for recipes that lack them'
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.filter(
+            image_variants_ready=False
+        ).exclude(image='').values_list('id', 'image')
+        for recipe_id, name in recipes.iterator():
+            make_variants(recipe_id, name)
+        self.stdout.write(self.style.SUCCESS(
+            'Рецептов без копий картинок: '
+            f'{Recipe.objects.filter(image_variants_ready=False).count()}'
+        ))
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from users.models import Subscriptions
+
+from recipes.feed import POPULAR_AUTHORS_KEY, popular_authors, trim_feeds
+from recipes.models import FeedItem, Recipe
+
+
+class Command(BaseCommand):
+    """Команда заполнения лент подписок заново.
+
+    Нужна для рецептов и подписок, созданных в обход сигналов
+    (bulk_create, загрузка данных), и после изменения FEED_MAX_ITEMS
+    или FEED_FANOUT_LIMIT.
+    """
+    help = 'rebuilding following feeds from subscriptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', default=None, type=int)
+
+    def handle(self, *args, **options):
+        cache.delete(POPULAR_AUTHORS_KEY)
+        popular = popular_authors()
+        followers = {}
+        for user, author in Subscriptions.objects.exclude(
+            author_id__in=popular
+        ).values_list('user_id', 'author_id').iterator():
+            followers.setdefault(author, []).append(user)
+        with transaction.atomic():
+            FeedItem.objects.all().delete()
+            for author, users in followers.items():
+                recipes = list(Recipe.objects.filter(
+                    author_id=author
+                ).order_by('-id').values_list('id', flat=True)[
+                    :settings.FEED_MAX_ITEMS
+                ])
+                FeedItem.objects.bulk_create(
+                    (FeedItem(user_id=user, recipe_id=recipe)
+                     for user in users for recipe in recipes),
+                    batch_size=options['batch_size']
+                )
+            trim_feeds(slack=0)
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в лентах: {FeedItem.objects.count()}, '
+            f'авторов без раскладки: {len(popular)}'
+        ))
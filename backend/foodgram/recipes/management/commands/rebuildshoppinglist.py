@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    """Команда пересборки списков покупок."""
+    help = ('rebuilding shopping list items from carts, '
+            'or verifying them with --verify')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='only compare stored items with carts')
+        # По умолчанию размер пачки выбирает бэкенд БД: у SQLite
+        # есть предел числа параметров в одном запросе.
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            self.verify()
+            return
+        with transaction.atomic():
+            ShoppingListItem.objects.all().delete()
+            ShoppingListItem.objects.bulk_create(
+                (ShoppingListItem(
+                    user_id=row['recipe__baskets__user'],
+                    ingredient_id=row['ingredient'],
+                    amount=row['amount']
+                ) for row in ShoppingListItem.objects.aggregate_cart(
+                ).iterator()),
+                batch_size=options['batch_size']
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересобрано строк: {ShoppingListItem.objects.count()}'
+        ))
+
+    def verify(self):
+        expected = {
+            (row['recipe__baskets__user'], row['ingredient']): row['amount']
+            for row in ShoppingListItem.objects.aggregate_cart().iterator()
+        }
+        stored = {
+            (user, ingredient): amount
+            for user, ingredient, amount in ShoppingListItem.objects.
+            values_list('user', 'ingredient', 'amount').iterator()
+        }
+        mismatches = [
+            key for key in expected.keys() | stored.keys()
+            if expected.get(key) != stored.get(key)
+        ]
+        for user, ingredient in mismatches:
+            self.stdout.write(
+                f'user={user} ingredient={ingredient}: '
+                f'ожидалось {expected.get((user, ingredient))}, '
+                f'сохранено {stored.get((user, ingredient))}'
+            )
+        if mismatches:
+            raise CommandError(
+                f'Расхождений: {len(mismatches)}, '
+                'запустите команду без --verify'
+            )
+        self.stdout.write(self.style.SUCCESS('Списки покупок актуальны'))
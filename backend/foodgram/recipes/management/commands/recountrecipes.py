@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorites, Recipe, ShoppingCart
+
+
+def count_subquery(model):
+    return Coalesce(Subquery(
+        model.objects.filter(recipe=OuterRef('pk')).order_by().values(
+            'recipe'
+        ).annotate(count=Count('pk')).values('count'),
+        output_field=IntegerField()
+    ), 0)
+
+
+class Command(BaseCommand):
+    """Команда сверки счётчиков избранного и корзин у рецептов."""
+    help = 'reconciling favorites_count and cart_count of recipes'
+
+    def handle(self, *args, **options):
+        stale = list(Recipe.objects.annotate(
+            actual_favorites=count_subquery(Favorites),
+            actual_carts=count_subquery(ShoppingCart)
+        ).exclude(
+            favorites_count=F('actual_favorites'),
+            cart_count=F('actual_carts')
+        ).values_list('id', flat=True))
+        Recipe.objects.filter(id__in=stale).update(
+            favorites_count=count_subquery(Favorites),
+            cart_count=count_subquery(ShoppingCart)
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено рецептов: {len(stale)}'
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.search import update_search_documents
+
+
+class Command(BaseCommand):
+    """Команда пересчёта поисковых документов рецептов."""
+    help = 'rebuilding full-text search documents of recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', default=5000, type=int)
+
+    def handle(self, *args, **options):
+        ids = list(Recipe.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(ids), options['batch_size']):
+            update_search_documents(ids[start:start + options['batch_size']])
+            self.stdout.write(
+                f'Обработано рецептов: '
+                f'{min(start + options["batch_size"], len(ids))}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Поисковые документы обновлены: {len(ids)}'
+        ))
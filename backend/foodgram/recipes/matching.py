@@ -0,0 +1,126 @@
+from array import array
+from collections import Counter
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import transaction
+
+from .indexes import ProcessIndex
+from .models import RecipeIngredient
+
+
+class RecipeMatchIndex(ProcessIndex):
+    """Обратный индекс ингредиент -> рецепты для подбора по продуктам.
+
+    Для каждого ингредиента хранится отсортированный массив id
+    рецептов, для каждого рецепта - его ингредиенты. Покрытие рецепта
+    набором продуктов считается подсчётом вхождений по массивам
+    выбранных ингредиентов, без запросов к базе. Индекс строится при
+    первом подборе. Изменённые рецепты отмечаются и перечитываются
+    одним запросом перед следующим подбором, полностью индекс
+    перестраивается раз в RECIPE_MATCH_INDEX_TTL секунд.
+    """
+    ttl_setting = 'RECIPE_MATCH_INDEX_TTL'
+
+    def __init__(self):
+        super().__init__()
+        # Массивы по ингредиентам и ингредиенты рецептов меняются только
+        # вместе, одним присваиванием пары.
+        self._data = None
+        self._stale = set()
+
+    def build(self):
+        rows = RecipeIngredient.objects.order_by(
+            'ingredient_id', 'recipe_id'
+        ).values_list('ingredient_id', 'recipe_id')
+        postings = {
+            ingredient: array('i', map(itemgetter(1), group))
+            for ingredient, group in groupby(
+                rows.iterator(), key=itemgetter(0)
+            )
+        }
+        recipes = {}
+        for ingredient, posting in postings.items():
+            for recipe in posting:
+                recipes.setdefault(recipe, []).append(ingredient)
+        self._stale = set()
+        self._data = (postings, {
+            recipe: frozenset(ingredients)
+            for recipe, ingredients in recipes.items()
+        })
+
+    def mark_stale(self, recipe_ids):
+        """Отмечает рецепты, у которых поменялись ингредиенты.
+
+        Как и сброс, отметка ставится после фиксации транзакции.
+        """
+        recipe_ids = tuple(recipe_ids)
+        transaction.on_commit(lambda: self.add_stale(recipe_ids))
+
+    def add_stale(self, recipe_ids):
+        with self._lock:
+            if self._built_at is not None:
+                self._stale.update(recipe_ids)
+
+    def update_recipes(self, recipe_ids):
+        """Перечитывает ингредиенты рецептов одним запросом.
+
+        Изменения вносятся в копии словарей, которые подменяются
+        целиком, поэтому параллельный подбор не видит их наполовину
+        изменёнными. Вызывается под _lock.
+        """
+        postings, recipes = self._data
+        postings, recipes = dict(postings), dict(recipes)
+        recipe_ids = set(recipe_ids)
+        current = {recipe: set() for recipe in recipe_ids}
+        for recipe, ingredient in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id'):
+            current[recipe].add(ingredient)
+        touched = set()
+        for recipe, ingredients in current.items():
+            touched |= ingredients ^ recipes.get(recipe, frozenset())
+            if ingredients:
+                recipes[recipe] = frozenset(ingredients)
+            else:
+                recipes.pop(recipe, None)
+        for ingredient in touched:
+            posting = {
+                recipe for recipe in postings.get(ingredient, ())
+                if recipe not in recipe_ids
+            }
+            posting.update(
+                recipe for recipe in recipe_ids
+                if ingredient in current[recipe]
+            )
+            postings[ingredient] = array('i', sorted(posting))
+        self._data = (postings, recipes)
+
+    def match(self, ingredient_ids, min_coverage=0.0):
+        """Рецепты с долей имеющихся ингредиентов не ниже min_coverage.
+
+        Возвращает список (id рецепта, совпало, всего ингредиентов),
+        сначала рецепты с большим покрытием.
+        """
+        self.ensure_built()
+        if self._stale:
+            with self._lock:
+                stale, self._stale = self._stale, set()
+                if stale:
+                    self.update_recipes(stale)
+        postings, recipes = self._data
+        hits = Counter()
+        for ingredient in set(ingredient_ids):
+            hits.update(postings.get(ingredient, ()))
+        matches = []
+        for recipe, matched in hits.items():
+            total = len(recipes.get(recipe, ()))
+            if total and matched >= min_coverage * total:
+                matches.append((recipe, matched, total))
+        matches.sort(
+            key=lambda match: (-match[1] / match[2], -match[1], -match[0])
+        )
+        return matches
+
+
+recipe_match_index = RecipeMatchIndex()
@@ -1,6 +1,9 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import F, Sum
 
 User = get_user_model()
 
@@ -40,11 +43,29 @@ class Ingredient(models.Model):
         ordering = ['-id']
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
 
+class SearchVectorIndex(GinIndex):
+    """GIN-индекс поискового документа.
+
+    Объявлен всегда, чтобы миграции не зависели от базы, на которой их
+    создали; на базах без GIN (SQLite в тестах) создаётся обычным.
+    """
+    def create_sql(self, model, schema_editor, using=''):
+        if schema_editor.connection.vendor != 'postgresql':
+            return models.Index.create_sql(self, model, schema_editor, using)
+        return super().create_sql(model, schema_editor, using)
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -57,6 +78,9 @@ class Recipe(models.Model):
     image = models.ImageField('Картинка',
                               upload_to='recipes/images'
                               )
+    image_variants_ready = models.BooleanField(
+        'Уменьшенные копии картинки готовы', default=False, editable=False
+    )
     text = models.TextField(
         'Описание рецепта', max_length=200
     )
@@ -74,11 +98,32 @@ class Recipe(models.Model):
     cooking_time = models.PositiveSmallIntegerField(
         'Время приготовления', validators=(MinValueValidator(1),)
     )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном', default=0, editable=False
+    )
+    cart_count = models.PositiveIntegerField(
+        'В корзинах', default=0, editable=False
+    )
+    # Поисковый документ PostgreSQL: название, ингредиенты, описание.
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         ordering = ['-id']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=('-favorites_count', '-id'),
+                name='recipe_popular_idx'
+            ),
+            models.Index(
+                fields=('author', '-id'),
+                name='recipe_author_idx'
+            ),
+            SearchVectorIndex(
+                fields=('search_vector',), name='recipe_search_idx'
+            )
+        ]
 
     def __str__(self):
         return self.name
@@ -124,11 +169,96 @@ class RecipeTag(models.Model):
                 name='Уникальность связи тега и рецепта'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=('tag', 'recipe'),
+                name='recipetag_tag_recipe_idx'
+            )
+        ]
 
     def __str__(self):
         return f'Тег {self.tag} связан с рецептом {self.recipe}'
 
 
+class UserRecipeManager(models.Manager):
+    """Рецепты пользователя; поле-счётчик рецепта задаёт counter модели.
+
+    Пакетные добавление и удаление - один INSERT или DELETE с RETURNING:
+    в ответе только строки, которые изменил именно этот запрос, так что
+    параллельные запросы не меняют счётчик дважды. Сигналы моделей при
+    этом не отправляются, счётчик меняется здесь же одним UPDATE.
+    """
+    def add_recipes(self, user, recipe_ids):
+        """Добавляет рецепты, которых ещё нет у пользователя.
+
+        Возвращает id добавленных рецептов.
+        """
+        recipe_ids = sorted(set(recipe_ids))
+        if not recipe_ids:
+            return []
+        values = ', '.join(['(%s, %s)'] * len(recipe_ids))
+        with transaction.atomic(using=self.db):
+            added = self.execute_returning(
+                f'INSERT INTO {self.table} ({self.columns}) '
+                f'VALUES {values} '
+                f'ON CONFLICT DO NOTHING RETURNING {self.recipe_column}',
+                [value for recipe_id in recipe_ids
+                 for value in (user.id, recipe_id)]
+            )
+            self.change_counter(added, 1)
+        return added
+
+    def remove_recipes(self, user, recipe_ids):
+        """Удаляет рецепты у пользователя, возвращает id удалённых."""
+        recipe_ids = sorted(set(recipe_ids))
+        if not recipe_ids:
+            return []
+        with transaction.atomic(using=self.db):
+            removed = self.execute_returning(
+                f'DELETE FROM {self.table} '
+                f'WHERE {self.user_column} = %s AND {self.recipe_column} '
+                f'IN ({", ".join(["%s"] * len(recipe_ids))}) '
+                f'RETURNING {self.recipe_column}',
+                [user.id, *recipe_ids]
+            )
+            self.change_counter(removed, -1)
+        return removed
+
+    @property
+    def table(self):
+        return connections[self.db].ops.quote_name(self.model._meta.db_table)
+
+    @property
+    def user_column(self):
+        return connections[self.db].ops.quote_name(
+            self.model._meta.get_field('user').column
+        )
+
+    @property
+    def recipe_column(self):
+        return connections[self.db].ops.quote_name(
+            self.model._meta.get_field('recipe').column
+        )
+
+    @property
+    def columns(self):
+        return f'{self.user_column}, {self.recipe_column}'
+
+    def execute_returning(self, sql, params):
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+    def change_counter(self, recipe_ids, delta):
+        if not recipe_ids:
+            return
+        counter = self.model.counter
+        recipes = Recipe.objects.filter(id__in=recipe_ids)
+        if delta < 0:
+            recipes = recipes.filter(**{f'{counter}__gt': 0})
+        recipes.update(**{counter: F(counter) + delta})
+
+
 class Favorites(models.Model):
     user = models.ForeignKey(
         User, on_delete=models.CASCADE,
@@ -141,6 +271,9 @@ class Favorites(models.Model):
         verbose_name='Рецепт в избранном'
     )
 
+    counter = 'favorites_count'
+    objects = UserRecipeManager()
+
     class Meta:
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
@@ -168,6 +301,9 @@ class ShoppingCart(models.Model):
         verbose_name='Рецепт в корзине'
     )
 
+    counter = 'cart_count'
+    objects = UserRecipeManager()
+
     class Meta:
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзина'
@@ -180,3 +316,169 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user} добавил в Корзину рецепт {self.recipe}'
+
+
+class ShoppingListItemManager(models.Manager):
+    def aggregate_cart(self, users=None, ingredients=None):
+        """Живая агрегация ингредиентов из корзин пользователей."""
+        # Условия на корзину собираются в один filter(), иначе Django
+        # присоединит таблицу корзины дважды и суммы задвоятся.
+        lookups = {'recipe__baskets__isnull': False}
+        if users is not None:
+            lookups['recipe__baskets__user__in'] = users
+        if ingredients is not None:
+            lookups['ingredient__in'] = ingredients
+        return RecipeIngredient.objects.filter(**lookups).values(
+            'recipe__baskets__user', 'ingredient'
+        ).annotate(amount=Sum('amount')).order_by()
+
+    def refresh(self, users, ingredients=None):
+        """Пересчитывает список покупок для указанных пользователей.
+
+        Если переданы ингредиенты, затрагиваются только их строки.
+        Строки пользователей блокируются до конца транзакции: иначе
+        параллельный пересчёт вставит те же строки списка, и запрос
+        упадёт на уникальности. Изменение корзины стоит делать в той же
+        транзакции, чтобы пересчёт после блокировки видел его.
+        """
+        with transaction.atomic():
+            list(User.objects.filter(id__in=users).order_by(
+                'id'
+            ).select_for_update().values_list('id', flat=True))
+            items = self.filter(user__in=users)
+            if ingredients is not None:
+                items = items.filter(ingredient__in=ingredients)
+            items.delete()
+            self.bulk_create(
+                ShoppingListItem(
+                    user_id=row['recipe__baskets__user'],
+                    ingredient_id=row['ingredient'],
+                    amount=row['amount']
+                ) for row in self.aggregate_cart(users, ingredients)
+            )
+
+
+class ShoppingListItem(models.Model):
+    """Итоговый список покупок пользователя.
+
+    Хранит суммарное количество каждого ингредиента из рецептов
+    в корзине, чтобы выгрузка не пересчитывала его заново.
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient, on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField('Количество')
+
+    objects = ShoppingListItemManager()
+
+    class Meta:
+        verbose_name = 'Список покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} -- {self.amount}'
+
+
+class SimilarRecipe(models.Model):
+    """Похожий рецепт по совместному добавлению в избранное и корзины.
+
+    Заполняется командой buildsimilar: для каждого рецепта хранятся
+    лучшие соседи по косинусной близости.
+    """
+    recipe = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE,
+        related_name='similar_recipes',
+        verbose_name='Рецепт'
+    )
+    similar = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE,
+        related_name='similar_to',
+        verbose_name='Похожий рецепт'
+    )
+    score = models.FloatField('Близость')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('recipe', 'similar'),
+                name='unique_similar_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('recipe', '-score'),
+                name='similar_recipe_score_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} ~ {self.similar}: {self.score:.3f}'
+
+
+class SimilaritySignature(models.Model):
+    """Отпечаток пользователей рецепта при последнем расчёте соседей.
+
+    По расхождению отпечатков buildsimilar находит изменившиеся рецепты.
+    """
+    recipe = models.OneToOneField(
+        Recipe, on_delete=models.CASCADE, primary_key=True,
+        related_name='similarity_signature',
+        verbose_name='Рецепт'
+    )
+    signature = models.BigIntegerField('Отпечаток', editable=False)
+
+    class Meta:
+        verbose_name = 'Отпечаток похожих рецептов'
+        verbose_name_plural = 'Отпечатки похожих рецептов'
+
+    def __str__(self):
+        return f'{self.recipe}: {self.signature}'
+
+
+class FeedItem(models.Model):
+    """Рецепт в ленте подписок пользователя.
+
+    Записывается при публикации рецепта всем подписчикам автора,
+    кроме авторов с очень большим числом подписчиков: их рецепты
+    подмешиваются в ленту при чтении (см. recipes.feed).
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Рецепт'
+    )
+
+    class Meta:
+        verbose_name = 'Лента подписок'
+        verbose_name_plural = 'Ленты подписок'
+        # Индекс уникальности (user, recipe) обслуживает и чтение
+        # ленты по убыванию id рецепта.
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.recipe}'
@@ -0,0 +1,149 @@
+import re
+from collections import defaultdict
+from itertools import chain
+
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import (Aggregate, Case, F, FloatField, OuterRef,
+                              Subquery, TextField, Value, When)
+
+from .indexes import ProcessIndex
+from .models import Recipe, RecipeIngredient
+
+CONFIG = 'russian'
+# Веса частей документа как у ts_rank: название, ингредиенты, описание.
+WEIGHTS = {'A': 1.0, 'B': 0.4, 'C': 0.2}
+WORD = re.compile(r'\w+')
+ENDINGS = sorted((
+    'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'иями',
+    'ать', 'ять', 'ить', 'еть', 'ться', 'ая', 'яя', 'ое', 'ее', 'ые',
+    'ие', 'ой', 'ей', 'ий', 'ый', 'ов', 'ев', 'ах', 'ях', 'ам', 'ям',
+    'ом', 'ем', 'ую', 'юю', 'ия', 'ии', 'ию', 'ье', 'ья', 'ью', 'а', 'я',
+    'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+STOP_WORDS = {
+    'а', 'в', 'во', 'для', 'до', 'за', 'и', 'из', 'к', 'на', 'не', 'но',
+    'о', 'от', 'по', 'с', 'со', 'у',
+}
+
+
+class StringAgg(Aggregate):
+    """STRING_AGG через пробел, без импорта psycopg2."""
+    function = 'STRING_AGG'
+    template = "%(function)s(%(expressions)s, ' ')"
+    output_field = TextField()
+
+
+def stem(word):
+    """Грубое отсечение окончаний для локального индекса."""
+    word = word.lower().replace('ё', 'е')
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def terms(text):
+    return [
+        stem(word) for word in WORD.findall(text.lower())
+        if word not in STOP_WORDS
+    ]
+
+
+class RecipeSearchIndex(ProcessIndex):
+    """Инвертированный индекс рецептов в памяти процесса.
+
+    Используется вместо полнотекстового поиска PostgreSQL на других
+    базах (SQLite в разработке и тестах). Перестраивается после
+    изменения рецептов или по истечении RECIPE_SEARCH_INDEX_TTL секунд.
+    """
+    ttl_setting = 'RECIPE_SEARCH_INDEX_TTL'
+
+    def __init__(self):
+        super().__init__()
+        self._postings = None
+
+    def build(self):
+        postings = defaultdict(lambda: defaultdict(float))
+        documents = chain(
+            (('A', recipe, name) for recipe, name in
+             Recipe.objects.values_list('id', 'name').iterator()),
+            (('B', recipe, name) for recipe, name in RecipeIngredient.objects.
+             values_list('recipe_id', 'ingredient__name').iterator()),
+            (('C', recipe, text) for recipe, text in
+             Recipe.objects.values_list('id', 'text').iterator()),
+        )
+        for weight, recipe, text in documents:
+            for term in terms(text):
+                postings[term][recipe] += WEIGHTS[weight]
+        self._postings = postings
+
+    def search(self, query, limit=None):
+        """id рецептов со всеми словами запроса и их ранг, лучшие первыми."""
+        self.ensure_built()
+        index = self._postings
+        postings = [index.get(term, {}) for term in set(terms(query))]
+        if not postings:
+            return []
+        postings.sort(key=len)
+        ranks = {
+            recipe: sum(posting[recipe] for posting in postings)
+            for recipe in postings[0]
+            if all(recipe in posting for posting in postings[1:])
+        }
+        return sorted(
+            ranks.items(), key=lambda item: (-item[1], -item[0])
+        )[:limit]
+
+
+recipe_search_index = RecipeSearchIndex()
+
+
+def update_search_documents(recipe_ids=None):
+    """Пересчитывает поисковые документы рецептов (все, если None)."""
+    if connection.vendor != 'postgresql':
+        recipe_search_index.invalidate()
+        return
+    ingredients = RecipeIngredient.objects.filter(
+        recipe=OuterRef('pk')
+    ).order_by().values('recipe').annotate(
+        names=StringAgg('ingredient__name')
+    ).values('names')
+    recipes = Recipe.objects.all()
+    if recipe_ids is not None:
+        recipes = recipes.filter(id__in=recipe_ids)
+    recipes.update(search_vector=(
+        SearchVector('name', weight='A', config=CONFIG)
+        + SearchVector(Subquery(ingredients), weight='B', config=CONFIG)
+        + SearchVector('text', weight='C', config=CONFIG)
+    ))
+
+
+def drop_search_documents(recipe_ids):
+    """Забывает удалённые рецепты.
+
+    В PostgreSQL документ удаляется вместе со строкой рецепта, индекс
+    в памяти на других базах перестраивается.
+    """
+    if connection.vendor != 'postgresql':
+        recipe_search_index.invalidate()
+
+
+def search_recipes(queryset, query):
+    """Рецепты, подходящие под запрос, по убыванию релевантности."""
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(query, config=CONFIG)
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-rank', '-id')
+    ranks = recipe_search_index.search(query, settings.RECIPE_SEARCH_LIMIT)
+    if not ranks:
+        return queryset.none()
+    return queryset.filter(id__in=[recipe for recipe, _ in ranks]).annotate(
+        rank=Case(
+            *(When(id=recipe, then=Value(rank)) for recipe, rank in ranks),
+            output_field=FloatField()
+        )
+    ).order_by('-rank', '-id')
@@ -0,0 +1,69 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from users.models import Subscriptions
+
+from . import feed
+from .autocomplete import ingredient_index
+from .matching import recipe_match_index
+from .models import Favorites, Ingredient, Recipe, ShoppingCart
+from .search import drop_search_documents, update_search_documents
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_document(sender, instance, created,
+                                  update_fields=None, **kwargs):
+    # Новый рецепт получает документ в RecipeSerializer.create, когда
+    # у него уже есть ингредиенты.
+    if created:
+        return
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        update_search_documents((instance.id,))
+
+
+@receiver(post_delete, sender=Recipe)
+def drop_recipe_from_indexes(sender, instance, **kwargs):
+    drop_search_documents((instance.id,))
+    recipe_match_index.mark_stale((instance.id,))
+
+
+@receiver(post_save, sender=Recipe)
+def push_recipe_to_feeds(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: feed.push_recipe(instance))
+
+
+@receiver(post_save, sender=Subscriptions)
+def add_author_to_feed(sender, instance, created, **kwargs):
+    if created:
+        feed.follow(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Subscriptions)
+def remove_author_from_feed(sender, instance, **kwargs):
+    feed.unfollow(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Favorites)
+@receiver(post_save, sender=ShoppingCart)
+def increment_recipe_counter(sender, instance, created, **kwargs):
+    if created:
+        counter = sender.counter
+        Recipe.objects.filter(id=instance.recipe_id).update(
+            **{counter: F(counter) + 1}
+        )
+
+
+@receiver(post_delete, sender=Favorites)
+@receiver(post_delete, sender=ShoppingCart)
+def decrement_recipe_counter(sender, instance, **kwargs):
+    counter = sender.counter
+    Recipe.objects.filter(
+        id=instance.recipe_id, **{f'{counter}__gt': 0}
+    ).update(**{counter: F(counter) - 1})
@@ -0,0 +1,72 @@
+import heapq
+from collections import defaultdict
+from math import sqrt
+
+from .models import Favorites, ShoppingCart
+
+# Вклад рецепта в вектор пользователя: корзина - более слабый сигнал,
+# чем избранное.
+SOURCES = ((Favorites, 1.0), (ShoppingCart, 0.5))
+
+
+class CoFavoriteMatrix:
+    """Разреженная матрица пользователь x рецепт.
+
+    Хранится в двух словарях - строки по пользователям и столбцы по
+    рецептам, - чтобы близость рецепта считалась только по тем
+    пользователям, которые его добавили. Пользователи, у которых
+    больше max_user_items рецептов, не учитываются: они почти ничего
+    не говорят о сходстве, но дают квадратичное число пар.
+    """
+    def __init__(self, max_user_items=None):
+        users = defaultdict(dict)
+        for model, weight in SOURCES:
+            for user, recipe in model.objects.values_list(
+                'user_id', 'recipe_id'
+            ).iterator():
+                row = users[user]
+                row[recipe] = max(row.get(recipe, 0), weight)
+        self.users = {
+            user: row for user, row in users.items()
+            if not max_user_items or len(row) <= max_user_items
+        }
+        self.recipes = defaultdict(dict)
+        for user, row in self.users.items():
+            for recipe, weight in row.items():
+                self.recipes[recipe][user] = weight
+        self.norms = {
+            recipe: sqrt(sum(weight * weight for weight in column.values()))
+            for recipe, column in self.recipes.items()
+        }
+
+    def neighbours(self, recipe, top_k, min_common=1):
+        """Лучшие top_k пар (близость, id рецепта) по косинусу.
+
+        min_common - сколько общих пользователей нужно, чтобы рецепты
+        считались похожими.
+        """
+        dots = defaultdict(float)
+        common = defaultdict(int)
+        for user, weight in self.recipes.get(recipe, {}).items():
+            for other, other_weight in self.users[user].items():
+                dots[other] += weight * other_weight
+                common[other] += 1
+        dots.pop(recipe, None)
+        norm = self.norms.get(recipe)
+        return heapq.nlargest(top_k, (
+            (dot / (norm * self.norms[other]), other)
+            for other, dot in dots.items()
+            if common[other] >= min_common
+        ))
+
+
+# Матрица для процессов-воркеров: задаётся до fork и наследуется ими
+# без копирования и без обращений к базе.
+matrix = None
+
+
+def neighbours_chunk(recipe_ids, top_k, min_common):
+    return [
+        (recipe, matrix.neighbours(recipe, top_k, min_common))
+        for recipe in recipe_ids
+    ]